@@ -1,12 +1,13 @@
-from flask import Blueprint, jsonify, request, render_template
-import shutil
-import os
-import time
-import datetime
-import psutil
+from flask import Blueprint, Response, jsonify, request, render_template, stream_with_context
+import hmac
 import logging
 from database import db_manager
+import metrics
 from api.common import login_required
+from bot_manager import apply_concurrency_settings
+from eviction import eviction_engine
+from status_snapshot import status_snapshot
+from status_stream import status_events
 from version import VERSION
 
 system_bp = Blueprint('system', __name__)
@@ -52,6 +53,22 @@ def swagger_spec():
                     "responses": {"200": {"description": "成功"}}
                 }
             },
+            "/api/status/stream": {
+                "get": {
+                    "tags": ["系统"],
+                    "summary": "实时进度推送 (Server-Sent Events)",
+                    "description": "连接时发送 snapshot 事件（完整状态，格式同 /api/status 的 data），之后只发送 delta 事件：tasks 为变化的任务字段，removed 为已结束的任务 ID，order 为活跃任务顺序，bot_status / system 有变化时整体下发",
+                    "responses": {"200": {"description": "text/event-stream"}}
+                }
+            },
+            "/metrics": {
+                "get": {
+                    "tags": ["系统"],
+                    "summary": "Prometheus 指标",
+                    "description": "文本格式 0.0.4。登录后可直接访问；抓取程序需携带 Authorization: Bearer <METRICS_TOKEN>",
+                    "responses": {"200": {"description": "text/plain"}, "401": {"description": "未登录且令牌无效"}}
+                }
+            },
             "/api/accounts": {
                 "get": {
                     "tags": ["账号"],
@@ -99,14 +116,50 @@ def swagger_spec():
             "/api/tasks": {
                 "get": {
                     "tags": ["任务"],
-                    "summary": "获取任务历史",
+                    "summary": "获取任务历史（游标分页，返回 next_cursor）",
+                    "description": "每个任务包含 timings（各阶段耗时，单位秒：queue 排队、slot 等待槽位、fetch 重新获取消息、prepare 准备、reserve 磁盘预留、verify 续传校验、db 登记任务、ttfb 首字节、transfer 传输、flush 写完并落盘、finalize 收尾；disk_write 为与传输并行的写盘时间）、avg_speed（字节/秒）与 resume_count（续传次数）",
                     "parameters": [
-                        {"name": "page", "in": "query", "schema": {"type": "integer", "default": 1}},
-                        {"name": "limit", "in": "query", "schema": {"type": "integer", "default": 20}}
+                        {"name": "cursor", "in": "query", "description": "上一页返回的 next_cursor", "schema": {"type": "integer"}},
+                        {"name": "limit", "in": "query", "schema": {"type": "integer", "default": 20, "maximum": 100}},
+                        {"name": "status", "in": "query", "description": "多个状态用逗号分隔", "schema": {"type": "string"}},
+                        {"name": "account_id", "in": "query", "schema": {"type": "integer"}},
+                        {"name": "channel_id", "in": "query", "schema": {"type": "integer"}},
+                        {"name": "since", "in": "query", "description": "开始时间下限 YYYY-MM-DD", "schema": {"type": "string"}},
+                        {"name": "until", "in": "query", "description": "开始时间上限 YYYY-MM-DD", "schema": {"type": "string"}},
+                        {"name": "q", "in": "query", "description": "按文件名与消息文本搜索", "schema": {"type": "string"}},
+                        {"name": "page", "in": "query", "description": "页码分页（兼容旧客户端，不支持筛选）", "schema": {"type": "integer"}}
                     ],
                     "responses": {"200": {"description": "成功"}}
                 }
             },
+            "/api/tasks/priority": {
+                "post": {
+                    "tags": ["任务"],
+                    "summary": "调整排队任务优先级",
+                    "requestBody": {
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "id": {"type": "integer"},
+                                        "priority": {"type": "integer"}
+                                    }
+                                }
+                            }
+                        }
+                    },
+                    "responses": {"200": {"description": "成功"}}
+                }
+            },
+            "/api/tasks/retry/{task_id}": {
+                "post": {
+                    "tags": ["任务"],
+                    "summary": "重试失败的任务（按已下载的分块续传）",
+                    "parameters": [{"name": "task_id", "in": "path", "required": True, "schema": {"type": "integer"}}],
+                    "responses": {"200": {"description": "成功"}}
+                }
+            },
             "/api/tasks/clear": {
                 "post": {
                     "tags": ["任务"],
@@ -152,71 +205,39 @@ def swagger_spec():
 @login_required
 def status():
     try:
-        from telegram_downloader import progress_status, bot_active_status
-        active_downloads = []
-        db_active_tasks = db_manager.get_active_tasks()
-        
-        for t in db_active_tasks:
-            acc_id = t['account_id']
-            msg_id = t['message_id']
-            progress_data = progress_status.get(acc_id, {}).get(msg_id, {})
-            
-            active_downloads.append({
-                'id': t['id'],
-                'acc_id': str(acc_id),
-                'channel_name': t['channel_name'] or t['account_name'] or '未知频道',
-                'name': t['file_name'],
-                'status': t['status'],
-                'percentage': progress_data.get('percentage', 0),
-                'downloaded': progress_data.get('downloaded_mb', 0),
-                'total': progress_data.get('total_mb', 0),
-                'speed': progress_data.get('speed', '0 MB/s')
-            })
-        
-        download_dir = db_manager.get_setting('DOWNLOAD_DIR', '/app/downloads')
-        if not os.path.exists(download_dir):
-            try: os.makedirs(download_dir, exist_ok=True)
-            except: download_dir = "."
-        
-        download_total, download_used, download_free = shutil.disk_usage(download_dir)
-        total, used, free = shutil.disk_usage('/')
-        memory = psutil.virtual_memory()
-        
-        boot_time = psutil.boot_time()
-        uptime_seconds = int(time.time() - boot_time)
-        try: load = list(psutil.getloadavg())
-        except AttributeError: load = [psutil.cpu_percent(), 0, 0]
-            
-        acc_status = {}
-        for acc_id, status_text in bot_active_status.items():
-            acc_status[acc_id] = status_text
-            
-        return jsonify({
-            'code': 200,
-            'data': {
-                'active_count': len(active_downloads),
-                'active_downloads': active_downloads,
-                'bot_status': acc_status,
-                'uptime': uptime_seconds,
-                'load': load,
-                'disk': {
-                    'total': total // (1024**3),
-                    'used': used // (1024**3),
-                    'free': free // (1024**3),
-                    'percent': int((used/total)*100) if total > 0 else 0,
-                    'download_dir_total': download_total // (1024**3),
-                    'download_dir_free': download_free // (1024**3)
-                },
-                'memory': {
-                    'total': round(memory.total / (1024**3), 1),
-                    'used': round(memory.used / (1024**3), 1),
-                    'percent': memory.percent
-                }
-            }
-        })
+        body, etag = status_snapshot.get()
     except Exception as e:
         logger.error(f"Status API Error: {e}")
         return jsonify({'code': 500, 'message': str(e)})
+    # no-cache：浏览器每次都会携带 If-None-Match 重新验证，内容未变化时只返回 304
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    # If-None-Match 按实体标签列表（含 * 与弱标签）做弱比较
+    if request.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+@system_bp.route('/api/status/stream')
+@login_required
+def status_stream():
+    """下载进度的 Server-Sent Events 推送，不支持 EventSource 的客户端继续轮询 /api/status"""
+    return Response(stream_with_context(status_events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # 关闭 nginx 反向代理的响应缓冲
+    })
+
+@system_bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标；登录后可直接访问，抓取程序使用 METRICS_TOKEN 设置的 Bearer 令牌"""
+    from flask import session
+    token = db_manager.get_setting('METRICS_TOKEN', '')
+    auth = request.headers.get('Authorization', '')
+    authorized = 'user_id' in session or (
+        token and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].strip(), str(token))
+    )
+    if not authorized:
+        return Response('unauthorized\n', status=401, mimetype='text/plain',
+                        headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @system_bp.route('/api/settings', methods=['GET', 'POST'])
 @login_required
@@ -225,12 +246,23 @@ def settings():
         data = request.get_json()
         for key, value in data.items():
             db_manager.set_setting(key, value)
+        apply_concurrency_settings()
+        eviction_engine.wake()
         return jsonify({'code': 200, 'message': '设置已保存'})
     return jsonify({'code': 200, 'data': {
         'DOWNLOAD_DIR': db_manager.get_setting('DOWNLOAD_DIR', '/app/downloads'),
         'SEND_CHANNEL_LOGIN_MSG': db_manager.get_setting('SEND_CHANNEL_LOGIN_MSG', 'False'),
         'MAX_CONCURRENT_DOWNLOADS': db_manager.get_setting('MAX_CONCURRENT_DOWNLOADS', '3'),
-        'FILE_RETENTION_DAYS': db_manager.get_setting('FILE_RETENTION_DAYS', '3')
+        'MAX_DOWNLOADS_PER_ACCOUNT': db_manager.get_setting('MAX_DOWNLOADS_PER_ACCOUNT', '3'),
+        'SMALLEST_FILE_FIRST': db_manager.get_setting('SMALLEST_FILE_FIRST', False),
+        'DOWNLOAD_CONNECTIONS': db_manager.get_setting('DOWNLOAD_CONNECTIONS', '4'),
+        'DISK_FSYNC_POLICY': db_manager.get_setting('DISK_FSYNC_POLICY', 'close'),
+        'NOTIFY_DIGEST_SECONDS': db_manager.get_setting('NOTIFY_DIGEST_SECONDS', '0'),
+        'FILE_RETENTION_DAYS': db_manager.get_setting('FILE_RETENTION_DAYS', '3'),
+        'DISK_FREE_LOW_GB': db_manager.get_setting('DISK_FREE_LOW_GB', '0'),
+        'DISK_FREE_HIGH_GB': db_manager.get_setting('DISK_FREE_HIGH_GB', '0'),
+        'METRICS_TOKEN': db_manager.get_setting('METRICS_TOKEN', ''),
+        'SHARED_EVENT_LOOP': db_manager.get_setting('SHARED_EVENT_LOOP', False)
     }})
 
 @system_bp.route('/api/settings/password', methods=['POST'])
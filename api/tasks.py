@@ -1,26 +1,81 @@
 from flask import Blueprint, jsonify, request
 import os
+import json
 import logging
 from database import db_manager
+import download_engine
+from filename_registry import filename_registry
+from eviction import eviction_engine
 from api.common import login_required
 
 tasks_bp = Blueprint('tasks', __name__)
 logger = logging.getLogger('tg_download_web.tasks')
 
+def _decode_timings(items: list) -> list:
+    """任务的阶段耗时以 JSON 文本保存，返回给前端时解码为对象"""
+    for item in items:
+        try:
+            item['timings'] = json.loads(item['timings']) if item.get('timings') else None
+        except ValueError:
+            item['timings'] = None
+    return items
+
 @tasks_bp.route('/api/tasks')
 @login_required
 def tasks():
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 20, type=int)
-    result = db_manager.get_tasks(page, limit)
-    return jsonify({'code': 200, 'data': result['list'], 'count': result['total']})
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    # 旧版客户端按页码分页
+    if 'page' in request.args and 'cursor' not in request.args:
+        result = db_manager.get_tasks(request.args.get('page', 1, type=int), limit)
+        return jsonify({'code': 200, 'data': _decode_timings(result['list']), 'count': result['total']})
+
+    result = db_manager.search_tasks(
+        cursor=request.args.get('cursor', type=int),
+        limit=limit,
+        status=request.args.get('status') or None,
+        account_id=request.args.get('account_id', type=int),
+        channel_id=request.args.get('channel_id', type=int),
+        since=request.args.get('since') or None,
+        until=request.args.get('until') or None,
+        keyword=request.args.get('q') or None
+    )
+    return jsonify({
+        'code': 200,
+        'data': _decode_timings(result['list']),
+        'count': result['total'],
+        'count_capped': result['total_capped'],
+        'next_cursor': result['next_cursor']
+    })
 
 @tasks_bp.route('/api/tasks/delete/<int:task_id>', methods=['POST'])
 @login_required
 def delete_task(task_id):
+    task = db_manager.get_task(task_id)
     db_manager.delete_task(task_id)
+    eviction_engine.untrack(task_id)
+    if task and task['file_path']:
+        # 失败任务保留的 .part 不会再被续传
+        if task['status'] in ('failed', 'stopped'):
+            download_engine.discard(task['file_path'])
+        filename_registry.release(task['file_path'])
     return jsonify({'code': 200, 'message': '记录已删除'})
 
+@tasks_bp.route('/api/tasks/retry/<int:task_id>', methods=['POST'])
+@login_required
+def retry_task(task_id):
+    task = db_manager.get_task(task_id)
+    if not task: return jsonify({'code': 404, 'message': '任务不存在'})
+    if task['status'] != 'failed':
+        return jsonify({'code': 400, 'message': '只能重试失败的任务'})
+
+    # 重新排队，保留的 .part 按分块位图续传（不再由淘汰引擎删除）；Bot 未运行时由启动后的任务恢复接手
+    eviction_engine.untrack(task_id)
+    db_manager.update_task_status(task_id, 'waiting', flush=True)
+    task['status'] = 'waiting'
+    from telegram_downloader import requeue_task
+    requeue_task(task)
+    return jsonify({'code': 200, 'message': '任务已重新排队'})
+
 @tasks_bp.route('/api/tasks/rename', methods=['POST'])
 @login_required
 def rename_task():
@@ -31,6 +86,7 @@ def rename_task():
     if '/' in new_name or '\\' in new_name or '..' in new_name:
         return jsonify({'code': 400, 'message': '文件名包含非法字符'})
 
+    db_manager.flush_tasks()
     conn = db_manager._get_connection()
     try:
         task = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
@@ -43,9 +99,16 @@ def rename_task():
         _, ext = os.path.splitext(old_path)
         if not os.path.splitext(new_name)[1]: new_name += ext
         new_path = os.path.join(dir_name, new_name)
-        if os.path.exists(new_path): return jsonify({'code': 400, 'message': '目标文件名已存在'})
-             
-        os.rename(old_path, new_path)
+        if not filename_registry.claim(new_path): return jsonify({'code': 400, 'message': '目标文件名已存在'})
+
+        try:
+            os.rename(old_path, new_path)
+        except Exception:
+            filename_registry.release(new_path)
+            raise
+        filename_registry.release(old_path)
+        if task['status'] == 'completed':
+            eviction_engine.track(task_id, new_path, task['end_time'])
         with conn:
             conn.execute("UPDATE tasks SET file_name = ?, file_path = ? WHERE id = ?", (new_name, new_path, task_id))
         return jsonify({'code': 200, 'message': '重命名成功'})
@@ -54,8 +117,31 @@ def rename_task():
         return jsonify({'code': 500, 'message': str(e)})
     finally: conn.close()
 
+@tasks_bp.route('/api/tasks/priority', methods=['POST'])
+@login_required
+def task_priority():
+    data = request.get_json()
+    task_id = data.get('id')
+    try:
+        priority = int(data.get('priority'))
+    except (ValueError, TypeError):
+        return jsonify({'code': 400, 'message': '优先级必须为整数'})
+    task = db_manager.get_task(task_id) if task_id else None
+    if not task: return jsonify({'code': 404, 'message': '任务不存在'})
+    if task['status'] != 'waiting':
+        return jsonify({'code': 400, 'message': '只能调整排队中任务的优先级'})
+
+    db_manager.update_task_priority(task['id'], priority)
+    # 同步到对应账号的内存调度队列
+    from telegram_downloader import bump_task_priority
+    bump_task_priority(task['account_id'], task['id'], priority)
+    return jsonify({'code': 200, 'message': '优先级已更新'})
+
 @tasks_bp.route('/api/tasks/clear', methods=['POST'])
 @login_required
 def clear_tasks():
-    db_manager.clear_tasks()
+    for file_path in db_manager.clear_tasks():
+        download_engine.discard(file_path)
+        filename_registry.release(file_path)
+    eviction_engine.clear()
     return jsonify({'code': 200, 'message': '已清空非活跃任务记录'})
@@ -0,0 +1,128 @@
+"""
+对比 DatabaseManager 任务相关方法在「每次新建连接」与「连接池」下的吞吐（ops/s）。
+unpooled 为连接池之前的行为：读写都新建连接，任务写入逐条同步提交；
+pooled 为当前实现：连接池，任务写入经 TaskWriter 合并后批量提交。
+
+用法: python benchmarks/bench_db.py [--ops 2000] [--threads 4]
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager, TASK_COLUMNS
+
+
+class UnpooledDatabaseManager(DatabaseManager):
+    """连接池之前的行为：每次调用都新建连接并在结束时关闭"""
+    def _get_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        # 与之前一致：仅在初始化时开启一次 WAL（journal_mode 会持久化到数据库文件）
+        conn = self._get_connection()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        finally:
+            conn.close()
+        super()._init_db()
+
+    def add_task(self, task_data: dict) -> int:
+        conn = self._get_connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    f"INSERT INTO tasks ({', '.join(TASK_COLUMNS)}) VALUES ({', '.join('?' * len(TASK_COLUMNS))})",
+                    tuple(task_data.get(col) for col in TASK_COLUMNS)
+                )
+                return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def update_task_status(self, task_id: int, status: str, end_time: str = None, error_msg: str = None,
+                           start_time: str = None, flush: bool = None):
+        fields = {'status': status}
+        if end_time:
+            fields.update(end_time=end_time, error_msg=error_msg)
+        elif start_time:
+            fields['start_time'] = start_time
+        conn = self._get_connection()
+        try:
+            with conn:
+                conn.execute(f"UPDATE tasks SET {', '.join(f'{col} = ?' for col in fields)} WHERE id = ?",
+                             tuple(fields.values()) + (task_id,))
+        finally:
+            conn.close()
+
+
+def make_task(i: int) -> dict:
+    return {
+        'account_id': 1,
+        'channel_id': 1,
+        'file_name': f"video_{i}.mp4",
+        'file_path': f"/tmp/video_{i}.mp4",
+        'file_size': 1024 * 1024,
+        'status': 'waiting',
+        'start_time': '2024-01-01 00:00:00',
+        'source_message_id': i,
+        'source_channel_id': -100123,
+    }
+
+
+def run_case(db, name, func, ops: int, threads: int) -> float:
+    per_thread = max(1, ops // threads)
+
+    def worker(offset):
+        for i in range(per_thread):
+            func(db, offset + i)
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in workers: t.start()
+    for t in workers: t.join()
+    # 写入由 TaskWriter 批量提交，计入提交耗时
+    db.flush_tasks()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+CASES = [
+    ('add_task', lambda db, i: db.add_task(make_task(i))),
+    ('update_task_status', lambda db, i: db.update_task_status(i % 500 + 1, 'downloading', start_time='2024-01-01 00:00:00')),
+    ('get_task', lambda db, i: db.get_task(i % 500 + 1)),
+    ('get_tasks', lambda db, i: db.get_tasks(page=i % 10 + 1, limit=20)),
+    ('get_active_tasks', lambda db, i: db.get_active_tasks()),
+    ('get_active_task_count', lambda db, i: db.get_active_task_count()),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, cls in (('unpooled', UnpooledDatabaseManager), ('pooled', DatabaseManager)):
+            db = cls(os.path.join(tmp, label, 'bench.db'))
+            db._init_db()
+            for i in range(500):
+                db.add_task(make_task(i))
+            for name, func in CASES:
+                results.setdefault(name, {})[label] = run_case(db, name, func, args.ops, args.threads)
+            db.close()
+
+    print(f"{'method':<24}{'unpooled ops/s':>16}{'pooled ops/s':>16}{'speedup':>10}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['unpooled']:>16.0f}{r['pooled']:>16.0f}{r['pooled'] / r['unpooled']:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+端到端下载流水线基准测试，无需 Telegram 账号。
+
+用 benchmarks/fake_telegram.py 中的客户端替身替换 TelegramClient，经由 bot_manager 启动真实的账号 Bot 线程
+（run_account_bot -> WorkerPool / handle_queue_item -> process_video_message），向各频道注入 NewMessage 事件，
+同时用 Flask 测试客户端轮询 /api/status。数据库与下载目录均在临时目录中，结束后删除。
+
+报告：文件数/秒、MB/s、事件到入队的延迟、数据库调用次数/秒（按方法）、/api/status 延迟、Telegram 消息数，
+以及 --duplicates 时内容相同的文件是否被替换为硬链接。
+
+用法: python benchmarks/bench_pipeline.py [--accounts 2] [--channels 3] [--files 200] [--size-mb 8]
+          [--bandwidth-mbps 0] [--latency-ms 20] [--chunk-kb 1024] [--failure-rate 0] [--rate 0] [--duplicates 0] [--shared-loop]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MB = 1024 * 1024
+# --duplicates 生成的重复文件共用的内容编号（不会与消息 ID 冲突）
+DUPLICATE_CONTENT_ID = 10 ** 9
+
+
+def percentiles(values: list, points=(50, 95, 99)) -> dict:
+    if not values:
+        return {p: 0.0 for p in points + ('max',)}
+    ordered = sorted(values)
+    result = {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def format_latency(name: str, values: list) -> str:
+    p = percentiles([v * 1000 for v in values])
+    return (f"{name:<22}{len(values):>8}  p50 {p[50]:>8.2f}  p95 {p[95]:>8.2f}  "
+            f"p99 {p[99]:>8.2f}  max {p['max']:>8.2f} ms")
+
+
+def db_call_counts(metrics) -> dict:
+    """{方法名: (调用次数, 总耗时)}"""
+    return {key[0]: (state[-1], state[-2]) for key, state in metrics.DB_QUERY_SECONDS._collect().items()}
+
+
+def wait_until(predicate, timeout: float, interval: float = 0.05) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+class StatusPoller(threading.Thread):
+    """模拟打开的管理面板：按固定间隔请求 /api/status 并记录延迟"""
+
+    def __init__(self, app, interval: float):
+        super().__init__(name='bench-status', daemon=True)
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 1
+        self.interval = interval
+        self.latencies = []
+        self.errors = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            start = time.perf_counter()
+            response = self.client.get('/api/status')
+            elapsed = time.perf_counter() - start
+            if response.status_code == 200 and response.get_json().get('code') == 200:
+                self.latencies.append(elapsed)
+            else:
+                self.errors += 1
+            self.stopping.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--channels', type=int, default=3, help='每个账号的频道数')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='每个账号的带宽 (MB/s)，0 为不限')
+    parser.add_argument('--latency-ms', type=float, default=20, help='每个下载请求的往返延迟')
+    parser.add_argument('--api-latency-ms', type=float, default=30, help='发送/编辑消息的延迟')
+    parser.add_argument('--chunk-kb', type=int, default=1024, help='分块大小，需为 4 的倍数且整除 1024')
+    parser.add_argument('--failure-rate', type=float, default=0, help='单个下载请求失败的概率')
+    parser.add_argument('--rate', type=float, default=0, help='每秒注入的消息数，0 为一次性注入')
+    parser.add_argument('--duplicates', type=float, default=0,
+                        help='重新上传（内容相同、文档 ID 不同）的文件比例，完成后应被替换为硬链接')
+    parser.add_argument('--concurrency', type=int, default=6, help='MAX_CONCURRENT_DOWNLOADS')
+    parser.add_argument('--per-account', type=int, default=3, help='MAX_DOWNLOADS_PER_ACCOUNT')
+    parser.add_argument('--connections', type=int, default=4, help='DOWNLOAD_CONNECTIONS')
+    parser.add_argument('--fsync', default='none', choices=('none', 'close', 'interval'))
+    parser.add_argument('--shared-loop', action='store_true', help='所有账号运行在同一个事件循环中 (SHARED_EVENT_LOOP)')
+    parser.add_argument('--status-interval', type=float, default=0.1, help='/api/status 轮询间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--drain-timeout', type=float, default=120,
+                        help='下载结束后等待消息总线发完状态消息的时间（受 Telegram 限速约束）')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--verbose', action='store_true', help='输出运行日志')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='tg-bench-')
+    # 数据库、会话与日志目录都使用相对路径，必须在导入之前切换工作目录
+    os.chdir(workdir)
+
+    import download_engine
+    import metrics
+    import bot_manager
+    import telegram_downloader
+    from database import db_manager
+    from tg_download_web import app
+    from fake_telegram import FakeMessage, FakeNetwork, FakeTelegramClient
+
+    # 失败率大于 0 时下载失败属于预期，默认不输出日志，结果见报告
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    download_engine.CHUNK_SIZE = args.chunk_kb * 1024
+    telegram_downloader.TelegramClient = FakeTelegramClient
+    # 记录各账号的消息总线，报告消息数之前等待它们发完
+    buses = []
+
+    class RecordingBus(telegram_downloader.MessageBus):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            buses.append(self)
+
+    telegram_downloader.MessageBus = RecordingBus
+    FakeTelegramClient.network = FakeNetwork(
+        bandwidth=args.bandwidth_mbps * MB, latency=args.latency_ms / 1000,
+        failure_rate=args.failure_rate, api_latency=args.api_latency_ms / 1000
+    )
+
+    for key, value in {
+        'DOWNLOAD_DIR': os.path.join(workdir, 'downloads'),
+        'MAX_CONCURRENT_DOWNLOADS': args.concurrency,
+        'MAX_DOWNLOADS_PER_ACCOUNT': args.per_account,
+        'DOWNLOAD_CONNECTIONS': args.connections,
+        'DISK_FSYNC_POLICY': args.fsync,
+        'SHARED_EVENT_LOOP': args.shared_loop,
+    }.items():
+        db_manager.set_setting(key, value)
+
+    chats = {}
+    for a in range(args.accounts):
+        acc_id = db_manager.add_account({
+            'name': f"bench-{a}", 'api_id': 1, 'api_hash': 'bench', 'bot_token': 'bench', 'session_name': f"bench_{a}"
+        })
+        chats[acc_id] = []
+        for c in range(args.channels):
+            chat_id = int(f"-100{a + 1:03d}{c + 1:04d}")
+            db_manager.add_channel({'account_id': acc_id, 'channel_id': str(chat_id), 'channel_name': f"bench-{a}-{c}"})
+            chats[acc_id].append(chat_id)
+
+    # 入队延迟：从注入事件到消息进入账号队列
+    enqueue_latencies = []
+
+    def instrument(queue):
+        put_nowait = queue.put_nowait
+
+        def wrapper(item, **kwargs):
+            message = item[0] if isinstance(item, tuple) else item
+            injected_at = getattr(message, 'injected_at', None)
+            if injected_at:
+                enqueue_latencies.append(time.perf_counter() - injected_at)
+            put_nowait(item, **kwargs)
+        queue.put_nowait = wrapper
+
+    for acc_id in chats:
+        bot_manager.start_account_bot(acc_id)
+    if not wait_until(lambda: all(acc_id in telegram_downloader.download_queues for acc_id in chats), 30):
+        sys.exit(f"Bot 启动超时: {telegram_downloader.bot_active_status}")
+    for acc_id in chats:
+        instrument(telegram_downloader.download_queues[acc_id])
+    # Bot 线程创建客户端的顺序不确定，按会话文件名对应到账号
+    clients = {acc_id: next(c for c in FakeTelegramClient.instances if c.session.endswith(f"bench_{a}"))
+               for a, acc_id in enumerate(chats)}
+
+    poller = StatusPoller(app, args.status_interval)
+    db_before = db_call_counts(metrics)
+    size = int(args.size_mb * MB)
+    accounts = list(chats)
+
+    def finished() -> int:
+        return sum(metrics.DOWNLOADS._collect().values())
+
+    print(f"{args.files} 个文件 × {args.size_mb}MB，{args.accounts} 个账号 × {args.channels} 个频道，"
+          f"带宽 {args.bandwidth_mbps or '不限'} MB/s/账号，延迟 {args.latency_ms}ms，分块 {args.chunk_kb}KB")
+    poller.start()
+    start = time.perf_counter()
+    for i in range(args.files):
+        acc_id = accounts[i % len(accounts)]
+        channel_chats = chats[acc_id]
+        chat_id = channel_chats[(i // len(accounts)) % len(channel_chats)]
+        # 按比例挑出的文件与第 0 个文件内容相同（文档 ID 不同），下载完成后应被替换为链接
+        duplicate = args.duplicates > 0 and (i == 0 or int(i * args.duplicates) != int((i - 1) * args.duplicates))
+        clients[acc_id].inject(FakeMessage(chat_id, size, caption=f"bench {i}",
+                                           content_id=DUPLICATE_CONTENT_ID if duplicate else None))
+        if args.rate > 0:
+            time.sleep(1 / args.rate)
+    completed = wait_until(lambda: finished() >= args.files, args.timeout, interval=0.01)
+    elapsed = time.perf_counter() - start
+    poller.stopping.set()
+    poller.join()
+    db_after = db_call_counts(metrics)
+
+    results = {}
+    for (_, result), count in metrics.DOWNLOADS._collect().items():
+        results[result] = results.get(result, 0) + count
+    downloaded = sum(metrics.DOWNLOAD_BYTES._collect().values())
+    done = results.get('completed', 0)
+    print(f"\n耗时 {elapsed:.2f}s{'' if completed else '（超时）'}，完成 {done}，失败 {results.get('failed', 0)}")
+    print(f"{'files/s':<22}{done / elapsed:>10.2f}")
+    print(f"{'MB/s':<22}{downloaded / MB / elapsed:>10.2f}")
+    print(format_latency('事件->入队', enqueue_latencies))
+    print(format_latency('/api/status', poller.latencies) + (f"  ({poller.errors} 次错误)" if poller.errors else ''))
+
+    calls = {name: (count - db_before.get(name, (0, 0))[0], total - db_before.get(name, (0, 0))[1])
+             for name, (count, total) in db_after.items()}
+    calls = {name: v for name, v in calls.items() if v[0] > 0}
+    print(f"{'DB ops/s':<22}{sum(c for c, _ in calls.values()) / elapsed:>10.1f}")
+    batches = sum(state[-1] for state in metrics.DB_WRITE_BATCH_SECONDS._collect().values())
+    batch_time = sum(state[-2] for state in metrics.DB_WRITE_BATCH_SECONDS._collect().values())
+    if batches:
+        print(f"  {'任务写入批次':<28}{batches:>8}{batches / elapsed:>10.1f}/s  avg {batch_time / batches * 1000:>7.3f} ms")
+    for name, (count, total) in sorted(calls.items(), key=lambda item: -item[1][1])[:8]:
+        print(f"  {name:<32}{count:>8}{count / elapsed:>10.1f}/s  avg {total / count * 1000:>7.3f} ms")
+
+    # 状态消息经消息总线按 Telegram 限速异步发出，下载结束时通常仍在排队
+    def queued() -> int:
+        # 总线在 Bot 线程中修改队列，读取时字典大小可能变化，重试即可
+        while True:
+            try:
+                return sum(b.pending for b in buses) + sum(c.in_flight for c in clients.values())
+            except RuntimeError:
+                pass
+
+    drain_start = time.perf_counter()
+    drained = wait_until(lambda: queued() == 0, args.drain_timeout)
+    drain_note = (f"（发完用时 {time.perf_counter() - drain_start:.1f}s）" if drained
+                  else f"（{args.drain_timeout:.0f}s 内未发完，仍有 {queued()} 条排队）")
+    print(f"{'Telegram 发送/编辑':<22}{sum(c.sent for c in clients.values()):>8} / {sum(c.edited for c in clients.values())}"
+          f"{drain_note}  下载请求 {sum(c.requests for c in clients.values())}（失败 {sum(c.failures for c in clients.values())}）")
+    if args.duplicates:
+        # 内容去重（media_index.dedupe_content）在下载计数之后执行，等消息发完后再统计；相同内容的文件应共享同一个 inode
+        inodes = {}
+        for entry in os.scandir(os.path.join(workdir, 'downloads')):
+            if entry.is_file() and not entry.name.endswith((download_engine.PART_SUFFIX, download_engine.MAP_SUFFIX)):
+                inodes.setdefault(entry.inode(), []).append(entry.name)
+        linked = sum(len(names) for names in inodes.values() if len(names) > 1)
+        print(f"{'内容去重':<22}{linked:>8} 个文件共享数据（{sum(1 for n in inodes.values() if len(n) > 1)} 组）")
+
+    bot_manager.stop_all_bots()
+    db_manager.close()
+    # 不切回原目录：仍在退出中的后台线程使用相对路径，切回会在仓库中创建数据库文件
+    if args.keep:
+        print(f"临时目录: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+在大量历史任务下测量状态查询的耗时（毫秒）。
+
+用法: python benchmarks/bench_task_queries.py [--rows 1000000] [--repeat 50]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+ACTIVE_ROWS = 50
+BASE_TIME = datetime(2024, 1, 1)
+
+
+def fill(db, rows: int):
+    random.seed(0)
+    conn = db._get_connection()
+    try:
+        with conn:
+            conn.executemany('''
+                INSERT INTO tasks (account_id, file_name, file_size, status, start_time, end_time, file_path, channel_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                (
+                    random.randint(1, 4), f"video_{i}.mp4", 1024 * 1024,
+                    'completed' if i % 10 else 'failed',
+                    '2024-01-01 00:00:00', (BASE_TIME + timedelta(seconds=i * 10)).strftime('%Y-%m-%d %H:%M:%S'),
+                    f"/downloads/video_{i}.mp4", random.randint(1, 20)
+                ) for i in range(rows)
+            ))
+            conn.executemany(
+                "INSERT INTO tasks (account_id, file_name, status, start_time) VALUES (?, ?, ?, ?)",
+                ((i % 4 + 1, f"active_{i}.mp4", 'downloading' if i < 5 else 'waiting', '2024-06-01 00:00:00')
+                 for i in range(ACTIVE_ROWS))
+            )
+            # 迁移时表为空，填充数据后重新收集统计信息
+            conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+CASES = [
+    ('get_active_task_count', lambda db: db.get_active_task_count()),
+    ('get_active_tasks', lambda db: db.get_active_tasks()),
+    ('get_unfinished_tasks_by_account', lambda db: db.get_unfinished_tasks_by_account(2)),
+    # 清理任务每小时执行，通常只命中少量刚过期的任务
+    ('get_expired_tasks', lambda db: db.get_expired_tasks('2024-01-01 01:00:00')),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        db._init_db()
+        start = time.perf_counter()
+        fill(db, args.rows)
+        print(f"写入 {args.rows} 条历史任务耗时 {time.perf_counter() - start:.1f}s")
+
+        print(f"{'query':<34}{'avg ms':>10}{'rows':>8}")
+        for name, func in CASES:
+            result = func(db)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                func(db)
+            elapsed = (time.perf_counter() - start) / args.repeat * 1000
+            rows = result if isinstance(result, int) else len(result)
+            print(f"{name:<34}{elapsed:>10.2f}{rows:>8}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+离线基准测试用的 Telethon 客户端替身。
+
+只实现下载流水线实际用到的接口：start / on / run_until_disconnected / disconnect / is_connected、
+iter_download、send_message / edit_message、get_messages，以及从其他线程注入 NewMessage 事件。
+iter_download 按可配置的带宽（整个客户端共享）、每个请求的往返延迟、分块大小与失败率生成数据，
+除非指定相同的 content_id，每个文件的内容互不相同，不会触发重复媒体去重。
+"""
+import asyncio
+import itertools
+import random
+import time
+from types import SimpleNamespace
+
+
+class FakeNetwork:
+    """模拟的网络条件；bandwidth 为整个客户端共享的带宽（字节/秒，0 表示不限）"""
+
+    def __init__(self, bandwidth: float = 0, latency: float = 0.0, failure_rate: float = 0.0,
+                 api_latency: float = 0.0, seed: int = 0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.api_latency = api_latency
+        self.random = random.Random(seed)
+
+
+class FakeMessage:
+    """带视频的频道消息，字段与 process_video_message / get_file_name_and_path 读取的一致"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id: int, size: int, caption: str = '', username: str = None, content_id: int = None):
+        """content_id: 相同的 content_id 生成逐字节相同的内容（模拟重新上传的同一视频，文档 ID 不同）"""
+        self.id = next(self._ids)
+        self.chat_id = chat_id
+        self.chat = SimpleNamespace(username=username)
+        self.text = caption
+        self.is_reply = False
+        self.document = SimpleNamespace(id=10 ** 12 + self.id, access_hash=self.id)
+        self.media = SimpleNamespace(document=self.document, size=size, content_id=content_id or self.id)
+        self.video = SimpleNamespace(attributes=[SimpleNamespace(file_name=f"video_{self.id}.mp4")])
+        self.file = SimpleNamespace(size=size)
+        self.injected_at = None
+
+
+class FakeEvent:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+
+
+class FakeTelegramClient:
+    """
+    接口与 TelegramClient 相同的替身，构造参数 (session, api_id, api_hash) 被忽略。
+    所有实例按创建顺序记录在 FakeTelegramClient.instances 中，供测试脚本注入事件。
+    """
+
+    network = FakeNetwork()
+    instances = []
+
+    def __init__(self, session=None, api_id=None, api_hash=None, network: FakeNetwork = None):
+        self.session = session
+        self.network = network or type(self).network
+        self.loop = None
+        self._handlers = []
+        self._connected = False
+        self._disconnected = None
+        self._message_ids = itertools.count(1)
+        self._link_free_at = 0.0
+        self._buffers = {}
+        self.sent = 0
+        self.edited = 0
+        self.in_flight = 0 # 正在进行的发送/编辑请求
+        self.requests = 0
+        self.failures = 0
+        self.bytes_served = 0
+        self.messages = {} # (chat_id, message_id) -> FakeMessage
+        type(self).instances.append(self)
+
+    # --- 连接 ---
+    async def start(self, *args, **kwargs):
+        self.loop = asyncio.get_running_loop()
+        self._disconnected = self.loop.create_future()
+        self._connected = True
+        return self
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def run_until_disconnected(self):
+        await self._disconnected
+
+    async def disconnect(self):
+        self._connected = False
+        if self._disconnected and not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    # --- 事件 ---
+    def on(self, event_builder):
+        def decorator(handler):
+            self._handlers.append(handler)
+            return handler
+        return decorator
+
+    def inject(self, message: FakeMessage):
+        """从任意线程注入一条新消息，等价于 Telegram 推送 NewMessage 更新"""
+        message.injected_at = time.perf_counter()
+        self.messages[(message.chat_id, message.id)] = message
+        self.loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message: FakeMessage):
+        for handler in self._handlers:
+            self.loop.create_task(handler(FakeEvent(message)))
+
+    # --- 消息 ---
+    async def send_message(self, chat_id, text, reply_to=None):
+        self.in_flight += 1
+        try:
+            if self.network.api_latency:
+                await asyncio.sleep(self.network.api_latency)
+            self.sent += 1
+            return SimpleNamespace(id=next(self._message_ids), chat_id=chat_id, text=text)
+        finally:
+            self.in_flight -= 1
+
+    async def edit_message(self, chat_id, message_id, text):
+        self.in_flight += 1
+        try:
+            if self.network.api_latency:
+                await asyncio.sleep(self.network.api_latency)
+            self.edited += 1
+        finally:
+            self.in_flight -= 1
+
+    async def get_messages(self, chat_id, ids=None):
+        return self.messages.get((chat_id, ids))
+
+    # --- 下载 ---
+    def _chunk(self, media, offset: int, size: int) -> bytes:
+        buffer = self._buffers.get(size)
+        if buffer is None:
+            buffer = self._buffers[size] = random.Random(size).randbytes(size)
+        # 每个文件（content_id）、每个分块的头部不同，内容指纹不会重复
+        header = media.content_id.to_bytes(8, 'little') + offset.to_bytes(8, 'little')
+        return header + buffer[len(header):size]
+
+    async def _transfer(self, size: int):
+        """按共享带宽排队发送 size 字节，再加上一次请求往返延迟"""
+        network = self.network
+        self.requests += 1
+        if network.failure_rate and network.random.random() < network.failure_rate:
+            self.failures += 1
+            await asyncio.sleep(network.latency)
+            raise ConnectionError("模拟的网络错误")
+        now = time.monotonic()
+        if network.bandwidth:
+            self._link_free_at = max(now, self._link_free_at) + size / network.bandwidth
+            delay = self._link_free_at - now
+        else:
+            delay = 0
+        await asyncio.sleep(delay + network.latency)
+        self.bytes_served += size
+
+    async def iter_download(self, media, offset: int = 0, limit: int = None, request_size: int = 128 * 1024):
+        count = 0
+        while offset < media.size and (limit is None or count < limit):
+            size = min(request_size, media.size - offset)
+            await self._transfer(size)
+            yield self._chunk(media, offset, size)
+            offset += size
+            count += 1
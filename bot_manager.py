@@ -3,12 +3,124 @@ import asyncio
 import threading
 import time
 from database import db_manager
+from scheduler import download_slots
 
 logger = logging.getLogger('tg_download_web.bot_manager')
 
+# 停止单个 Bot 时等待其退出的时间（秒）
+STOP_TIMEOUT = 10
+
 # {account_id: (stop_event, thread)}
 bot_instances = {}
 
+
+class SharedLoopSupervisor:
+    """
+    共享事件循环模式（设置 SHARED_EVENT_LOOP）：所有账号的 Bot 作为任务运行在同一个常驻事件循环中，
+    账号数量增加时不再增加线程与事件循环，下载槽位、磁盘预留等跨账号的调度也都在同一个循环内完成。
+    start / stop 可以从任意线程（Flask 请求）调用，通过 run_coroutine_threadsafe 在循环中串行执行；
+    每个账号的 Bot 是独立的任务，单个账号出错或被停止不影响其他账号。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._bots = {} # account_id -> (stop_event, task)，只在循环线程中访问
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self._loop
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name='bot-loop', daemon=True)
+            self._thread.start()
+            ready.wait()
+            return self._loop
+
+    def _call(self, coro, timeout: float):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result(timeout)
+
+    def start(self, account: dict):
+        """（重新）启动账号的 Bot，旧实例完全停止后才启动新实例"""
+        self._call(self._start(account), STOP_TIMEOUT + 5)
+
+    def stop(self, account_id: int):
+        self._call(self._stop(account_id), STOP_TIMEOUT + 5)
+
+    def stop_all(self):
+        if self._loop is None:
+            return
+        self._call(self._stop_all(), STOP_TIMEOUT + 5)
+
+    async def _start(self, account: dict):
+        import telegram_downloader
+        await self._stop(account['id'])
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(self._run(telegram_downloader.run_account_bot, account, stop_event),
+                                   name=f"bot:{account['name']}")
+        self._bots[account['id']] = (stop_event, task)
+
+    @staticmethod
+    async def _run(run_account_bot, account: dict, stop_event):
+        try:
+            await run_account_bot(account, stop_event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 只结束出错的账号，循环与其他账号的 Bot 继续运行
+            logger.error(f"Account bot {account['name']} error: {e}")
+
+    async def _stop(self, account_id: int):
+        bot = self._bots.pop(account_id, None)
+        if not bot:
+            return
+        stop_event, task = bot
+        stop_event.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Bot {account_id} 未在 {STOP_TIMEOUT} 秒内停止，强制取消")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        except Exception:
+            pass
+
+    async def _stop_all(self):
+        await asyncio.gather(*(self._stop(acc_id) for acc_id in list(self._bots)))
+
+
+supervisor = SharedLoopSupervisor()
+_shared_loop = None
+
+
+def shared_loop_enabled() -> bool:
+    """运行模式在进程内第一次启动 Bot 时确定，修改设置后需重启服务"""
+    global _shared_loop
+    if _shared_loop is None:
+        _shared_loop = db_manager.get_bool_setting('SHARED_EVENT_LOOP', False)
+    return _shared_loop
+
+def apply_concurrency_settings():
+    """将并发与调度相关设置同步到运行中的调度器（设置保存后立即生效）"""
+    download_slots.set_limit(db_manager.get_int_setting('MAX_CONCURRENT_DOWNLOADS', 3, minimum=1))
+
+    import telegram_downloader
+    per_account = telegram_downloader.get_per_account_limit()
+    for pool in list(telegram_downloader.worker_pools.values()):
+        pool.resize_threadsafe(per_account)
+    smallest_first = telegram_downloader.get_smallest_first()
+    for queue in list(telegram_downloader.download_queues.values()):
+        if queue.loop and not queue.loop.is_closed():
+            queue.loop.call_soon_threadsafe(queue.set_smallest_first, smallest_first)
+
 def start_account_bot(account_id):
     """为单个账号启动bot (管理该账号下所有频道)"""
     try:
@@ -27,6 +139,13 @@ def start_account_bot(account_id):
         return
         
     import telegram_downloader
+    apply_concurrency_settings()
+    if shared_loop_enabled():
+        try:
+            supervisor.start(target_acc)
+        except Exception as e:
+            logger.error(f"Error starting bot {account_id}: {e}")
+        return
     stop_event = asyncio.Event()
     
     def run():
@@ -42,6 +161,12 @@ def start_account_bot(account_id):
     bot_instances[account_id] = (stop_event, t)
 
 def stop_account_bot(account_id):
+    if shared_loop_enabled():
+        try:
+            supervisor.stop(account_id)
+        except Exception as e:
+            logger.error(f"Error stopping bot {account_id}: {e}")
+        return
     if account_id in bot_instances:
         stop_event, t = bot_instances.pop(account_id)
         try:
@@ -56,6 +181,9 @@ def stop_account_bot(account_id):
 
 def stop_all_bots():
     """停止所有正在运行的 Bot"""
+    if shared_loop_enabled():
+        supervisor.stop_all()
+        return
     for acc_id in list(bot_instances.keys()):
         stop_account_bot(acc_id)
     time.sleep(1)
@@ -0,0 +1,79 @@
+import re
+import threading
+
+from database import db_manager
+
+_NUMERIC = re.compile(r'^-?\d+$')
+
+
+def normalize_channel_ref(ref) -> tuple:
+    """
+    把频道配置（ID、-100 前缀 ID、用户名、@用户名、t.me 链接）规范化为 (peer_id 集合, 小写用户名)。
+    Telethon 的 chat_id 为带标记的 ID：频道/超级群为 -100xxx，未带前缀的正整数按频道 ID 处理。
+    """
+    ref = str(ref or '').strip()
+    if 't.me/' in ref:
+        parts = [p for p in ref.split('t.me/', 1)[1].split('?')[0].split('/') if p]
+        if len(parts) >= 2 and parts[0] == 'c' and parts[1].isdigit():
+            # 私有频道链接 t.me/c/<id>/<msg>
+            return {int(f"-100{parts[1]}")}, None
+        ref = parts[0] if parts else ''
+    ref = ref.lstrip('@')
+    if not ref:
+        return set(), None
+    if _NUMERIC.match(ref):
+        peer_id = int(ref)
+        ids = {peer_id}
+        if peer_id > 0:
+            ids.add(int(f"-100{peer_id}"))
+        return ids, None
+    return set(), ref.lower()
+
+
+class ChannelResolver:
+    """
+    消息来源 -> 频道记录的解析索引。
+    每个账号的频道配置只在频道变更（db.channels_version 递增）后重新加载并规范化一次，
+    之后按 peer_id / 用户名做哈希查找，不再访问数据库，也不做子串匹配。
+    """
+
+    def __init__(self, db=db_manager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._indexes = {} # account_id -> (version, by_peer_id, by_username, by_db_id)
+
+    def _index(self, account_id):
+        version = self.db.channels_version
+        index = self._indexes.get(account_id)
+        if index is None or index[0] != version:
+            with self._lock:
+                index = self._indexes.get(account_id)
+                if index is None or index[0] != version:
+                    index = self._build(account_id, version)
+                    self._indexes[account_id] = index
+        return index
+
+    def _build(self, account_id, version):
+        by_peer_id, by_username, by_db_id = {}, {}, {}
+        for ch in self.db.get_channels(account_id):
+            by_db_id[ch['id']] = ch
+            ids, username = normalize_channel_ref(ch['channel_id'])
+            # 重复配置时与之前一致，以先添加的频道为准
+            for peer_id in ids:
+                by_peer_id.setdefault(peer_id, ch)
+            if username:
+                by_username.setdefault(username, ch)
+        return version, by_peer_id, by_username, by_db_id
+
+    def resolve(self, account_id, chat_id, username: str = None):
+        _, by_peer_id, by_username, _ = self._index(account_id)
+        channel = by_peer_id.get(chat_id)
+        if channel is None and username:
+            channel = by_username.get(username.lower())
+        return channel
+
+    def get(self, account_id, channel_db_id):
+        return self._index(account_id)[3].get(channel_db_id)
+
+
+channel_resolver = ChannelResolver()
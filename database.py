@@ -1,161 +1,330 @@
 import sqlite3
 import json
+import logging
 import os
 import hashlib
+import time
 import threading
+import collections
+import functools
 from typing import Any, Dict, List, Optional
 
+import migrations
+import metrics
+
+# 连接池最多保留的空闲连接数
+POOL_SIZE = 8
+# 任务历史统计最多数到的条数及缓存时间（秒），保证大表翻页时统计开销恒定
+TASK_COUNT_CAP = 10000
+TASK_COUNT_TTL = 30
+# 任务写入合并：积累写入的最长时间（秒）、提前提交的批量大小，以及 flush 的最长等待时间
+TASK_WRITE_DELAY = 0.2
+TASK_WRITE_BATCH = 500
+TASK_FLUSH_TIMEOUT = 30
+# 同一批写入连续失败的次数达到上限后逐个任务提交，丢弃无法写入的任务，避免一行坏数据阻塞全部写入
+TASK_WRITE_RETRIES = 3
+# 进入这些状态时立即提交
+TERMINAL_STATUSES = ('completed', 'failed')
+TASK_COLUMNS = (
+    'account_id', 'message_id', 'file_name', 'file_size', 'status', 'start_time', 'file_path',
+    'channel_id', 'source_message_id', 'source_channel_id', 'priority', 'caption'
+)
+# 每个连接建立时执行一次
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-8192', # 8MB 页缓存
+    'PRAGMA mmap_size=67108864', # 64MB 内存映射
+)
+
+# 频道的重复媒体处理策略（见 media_index）
+DEDUP_POLICIES = ('link', 'off')
+
+# 未提供的字段返回 None，更新时保留数据库中的原值
+def _channel_priority(data: Dict) -> Optional[int]:
+    return int(data.get('priority') or 0) if 'priority' in data else None
+
+def _channel_weight(data: Dict) -> Optional[int]:
+    return max(1, int(data.get('weight') or 1)) if 'weight' in data else None
+
+def _dedup_policy(data: Dict) -> str:
+    policy = data.get('dedup_policy')
+    return policy if policy in DEDUP_POLICIES else DEDUP_POLICIES[0]
+
+class PooledConnection:
+    """从连接池借出的连接，close() 会把底层连接归还到池中而不是真正关闭"""
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+class ConnectionPool:
+    """
+    SQLite 连接池（借出/归还）。
+    连接在线程间复用，PRAGMA 只在建立连接时执行一次，页缓存随连接保留；
+    空闲连接超过 size 或连接池关闭后，归还的连接直接关闭。
+    """
+    def __init__(self, db_path: str, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        return PooledConnection(self, conn or self._connect())
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """关闭所有空闲连接，之后借出的连接在归还时直接关闭"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+class TaskWriter:
+    """
+    任务表的写后合并线程。
+    新增任务与状态更新只在内存中登记（任务 id 预先分配），同一任务的多次更新合并为一次，
+    后台线程每 TASK_WRITE_DELAY 秒把积累的写入放进一个事务提交，避免多个账号线程争抢写锁。
+    flush() 等待此前登记的写入全部提交，读取任务表之前调用即可读到自己的写入。
+    """
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict() # task_id -> {'insert': dict | None, 'fields': dict}
+        self._seq = 0 # 已登记的写入序号
+        self._committed = 0 # 已提交的写入序号
+        self._flush_requested = False
+        self._failures = 0 # 当前批次连续失败的次数
+        self._next_id = None
+        self._thread = None
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _allocate_id(self) -> int:
+        if self._next_id is None:
+            conn = self._pool.acquire()
+            try:
+                max_id = conn.execute("SELECT MAX(id) FROM tasks").fetchone()[0] or 0
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'").fetchone()
+                self._next_id = max(max_id, row[0] if row else 0) + 1
+            finally:
+                conn.close()
+        task_id = self._next_id
+        self._next_id += 1
+        return task_id
+
+    def _submit(self):
+        self._seq += 1
+        if not self._thread and not self._closed:
+            self._thread = threading.Thread(target=self._run, name='task-writer', daemon=True)
+            self._thread.start()
+        self._cond.notify_all()
+
+    def insert(self, data: Dict) -> int:
+        with self._cond:
+            task_id = self._allocate_id()
+            self._pending[task_id] = {'insert': data, 'fields': {}}
+            self._submit()
+            return task_id
+
+    def update(self, task_id: int, fields: Dict):
+        with self._cond:
+            entry = self._pending.get(task_id)
+            if entry is None:
+                entry = self._pending[task_id] = {'insert': None, 'fields': {}}
+            entry['fields'].update(fields)
+            self._submit()
+
+    def flush(self, timeout: float = TASK_FLUSH_TIMEOUT) -> bool:
+        """等待已登记的写入提交完成，超时返回 False"""
+        with self._cond:
+            target = self._seq
+            if self._committed >= target:
+                return True
+            if not self._thread:
+                # 连接池关闭后没有写线程，直接在当前线程提交
+                batch, self._pending = self._pending, collections.OrderedDict()
+                self._write(batch)
+                self._committed = target
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._committed >= target, timeout):
+                logging.warning(f"任务写入 flush 超时，仍有 {len(self._pending)} 个任务未提交")
+                return False
+            return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread:
+            thread.join(TASK_FLUSH_TIMEOUT)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # 积累一批写入；flush、关闭或批量已满时提前提交
+                deadline = time.monotonic() + TASK_WRITE_DELAY
+                while not (self._flush_requested or self._closed or len(self._pending) >= TASK_WRITE_BATCH):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        break
+                batch, self._pending = self._pending, collections.OrderedDict()
+                seq = self._seq
+                self._flush_requested = False
+            try:
+                if self._failures >= TASK_WRITE_RETRIES:
+                    self._write_each(batch)
+                else:
+                    self._write(batch)
+            except Exception as e:
+                self._failures += 1
+                logging.error(f"批量写入 {len(batch)} 个任务失败（第 {self._failures} 次），稍后重试: {e}")
+                with self._cond:
+                    self._requeue(batch)
+                time.sleep(1)
+                continue
+            self._failures = 0
+            with self._cond:
+                self._committed = seq
+                self._cond.notify_all()
+
+    def _requeue(self, batch):
+        """失败的批次放回队首，与之后登记的写入合并（新的字段覆盖旧的）"""
+        merged = collections.OrderedDict()
+        for task_id, entry in batch.items():
+            newer = self._pending.pop(task_id, None)
+            if newer:
+                entry = {'insert': entry['insert'] or newer['insert'], 'fields': {**entry['fields'], **newer['fields']}}
+            merged[task_id] = entry
+        merged.update(self._pending)
+        self._pending = merged
+
+    def _write_each(self, batch):
+        """
+        逐个任务提交；因数据本身写入失败的任务记录日志后丢弃。
+        数据库本身出错（锁、磁盘、I/O）时停止并抛出，已提交和已丢弃的任务从 batch 中移除，其余的整批重试
+        """
+        for task_id, entry in list(batch.items()):
+            try:
+                self._write({task_id: entry})
+            except sqlite3.OperationalError:
+                raise
+            except Exception as e:
+                logging.error(f"任务 {task_id} 写入失败，已丢弃: {e} ({entry})")
+            del batch[task_id]
+
+    def _write(self, batch):
+        started = time.monotonic()
+        inserts, updates = [], collections.defaultdict(list)
+        for task_id, entry in batch.items():
+            if entry['insert'] is not None:
+                data = {**entry['insert'], **entry['fields']}
+                inserts.append((task_id,) + tuple(data.get(col) for col in TASK_COLUMNS))
+                # 同一批次内完成的任务：插入列之外的字段（end_time、error_msg 等）随后更新
+                extra = {col: value for col, value in entry['fields'].items() if col not in TASK_COLUMNS}
+                if extra:
+                    updates[tuple(extra)].append(tuple(extra.values()) + (task_id,))
+            elif entry['fields']:
+                columns = tuple(entry['fields'])
+                updates[columns].append(tuple(entry['fields'][col] for col in columns) + (task_id,))
+        conn = self._pool.acquire()
+        try:
+            with conn:
+                if inserts:
+                    conn.executemany(
+                        f"INSERT INTO tasks (id, {', '.join(TASK_COLUMNS)}) VALUES ({', '.join('?' * (len(TASK_COLUMNS) + 1))})",
+                        inserts
+                    )
+                for columns, rows in updates.items():
+                    assignments = ', '.join(f"{col} = ?" for col in columns)
+                    conn.executemany(f"UPDATE tasks SET {assignments} WHERE id = ?", rows)
+        finally:
+            conn.close()
+        metrics.DB_WRITE_BATCH_SECONDS.observe(time.monotonic() - started)
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "data/tg_download.db"):
+    def __init__(self, db_path: str = "data/tg_download.db", pool_size: int = POOL_SIZE):
         self.db_path = db_path
         self.lock = threading.Lock()
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.task_writer = TaskWriter(self.pool)
+        # 任务统计缓存 { (where, params): (过期时间, (count, capped)) }
+        self._count_cache = {}
+        self._fts = None
+        # 通知配置每次变更时递增，供通知分发器判断缓存是否失效
+        self.notifications_version = 0
+        # 频道配置每次变更时递增，供频道解析索引判断是否需要重建
+        self.channels_version = 0
+        # 设置缓存（key -> 解码后的值），首次读取时整表加载，set_setting 写穿更新
+        self._settings = None
+        self._settings_lock = threading.Lock()
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
 
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.acquire()
+
+    def close(self):
+        self.task_writer.close()
+        self.pool.close()
+
+    def flush_tasks(self) -> bool:
+        """提交所有已登记的任务写入"""
+        return self.task_writer.flush()
 
     def _init_db(self):
+        """按版本执行数据库迁移（见 migrations.py）"""
         with self.lock:
             conn = self._get_connection()
             try:
-                # 启用 WAL 模式提高并发性能
-                conn.execute('PRAGMA journal_mode=WAL')
-                conn.execute('PRAGMA synchronous=NORMAL')
-                with conn:
-                    # 设置表 (全局通用)
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS settings (
-                            key TEXT PRIMARY KEY,
-                            value TEXT
-                        )
-                    ''')
-                    # 用户表
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS users (
-                            username TEXT PRIMARY KEY,
-                            password TEXT
-                        )
-                    ''')
-                    # Telegram 账号表（仅存储认证信息）
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS accounts (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT,
-                            api_id INTEGER,
-                            api_hash TEXT,
-                            bot_token TEXT,
-                            session_name TEXT,
-                            created_at TEXT
-                        )
-                    ''')
-                    
-                    # 频道监听表（每个频道一条记录）
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS channels (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            account_id INTEGER,
-                            channel_id TEXT,
-                            channel_name TEXT,
-                            enabled INTEGER DEFAULT 1,
-                            status TEXT DEFAULT 'stopped',
-                            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE
-                        )
-                    ''')
-                    # 通知配置表
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS notifications (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT,
-                            type TEXT, -- e.g. 'bark'
-                            config TEXT, -- JSON string
-                            enabled INTEGER DEFAULT 1
-                        )
-                    ''')
-                    # 下载任务历史表
-                    conn.execute('''
-                        CREATE TABLE IF NOT EXISTS tasks (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            account_id INTEGER,
-                            message_id INTEGER,
-                            file_name TEXT,
-                            file_size REAL,
-                            status TEXT,
-                            start_time TEXT,
-                            end_time TEXT,
-                            error_msg TEXT
-                        )
-                    ''')
-                    
-                    # 自动迁移：检查 tasks 表是否存在 account_id 和 file_path 列
-                    try:
-                        cursor = conn.execute("PRAGMA table_info(tasks)")
-                        columns = [column[1] for column in cursor.fetchall()]
-                        if 'account_id' not in columns:
-                            conn.execute("ALTER TABLE tasks ADD COLUMN account_id INTEGER")
-                        if 'file_path' not in columns:
-                            conn.execute("ALTER TABLE tasks ADD COLUMN file_path TEXT")
-                        if 'channel_id' not in columns:
-                             conn.execute("ALTER TABLE tasks ADD COLUMN channel_id INTEGER")
-                        if 'source_message_id' not in columns:
-                             conn.execute("ALTER TABLE tasks ADD COLUMN source_message_id INTEGER")
-                        if 'source_channel_id' not in columns:
-                             conn.execute("ALTER TABLE tasks ADD COLUMN source_channel_id INTEGER")
-                    except Exception as e:
-                        print(f"Migration error (tasks columns): {e}")
-
-                    # 自动迁移：检查 channels 表是否存在 custom_path 列
-                    try:
-                        cursor = conn.execute("PRAGMA table_info(channels)")
-                        columns = [column[1] for column in cursor.fetchall()]
-                        if 'custom_path' not in columns:
-                            conn.execute("ALTER TABLE channels ADD COLUMN custom_path TEXT")
-                    except Exception as e:
-                        print(f"Migration error (channels.custom_path): {e}")
-
-                    # 自动迁移：从旧的accounts表迁移数据到新结构
-                    try:
-                        cursor = conn.execute("PRAGMA table_info(accounts)")
-                        old_columns = [column[1] for column in cursor.fetchall()]
-                        if 'channel_id' in old_columns and 'created_at' not in old_columns:
-                            # 旧结构，需要迁移
-                            old_accounts = conn.execute("SELECT * FROM accounts").fetchall()
-                            # 重命名旧表
-                            conn.execute("ALTER TABLE accounts RENAME TO accounts_old")
-                            # 创建新表结构
-                            conn.execute('''
-                                CREATE TABLE accounts (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    name TEXT,
-                                    api_id INTEGER,
-                                    api_hash TEXT,
-                                    bot_token TEXT,
-                                    session_name TEXT,
-                                    created_at TEXT
-                                )
-                            ''')
-                            # 迁移账号数据
-                            for old_acc in old_accounts:
-                                conn.execute('''
-                                    INSERT INTO accounts (id, name, api_id, api_hash, bot_token, session_name, created_at)
-                                    VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
-                                ''', (old_acc[0], old_acc[1], old_acc[2], old_acc[3], old_acc[4], old_acc[6]))
-                                
-                                # 迁移频道数据（拆分逗号分隔的频道）
-                                if old_acc[5]:  # channel_id字段
-                                    for ch_id in str(old_acc[5]).split(','):
-                                        ch_id = ch_id.strip()
-                                        if ch_id:
-                                            conn.execute('''
-                                                INSERT INTO channels (account_id, channel_id, channel_name, enabled, status)
-                                                VALUES (?, ?, ?, ?, ?)
-                                            ''', (old_acc[0], ch_id, ch_id, old_acc[7] if len(old_acc) > 7 else 1, 'stopped'))
-                            # 删除旧表
-                            conn.execute("DROP TABLE accounts_old")
-                            print("Successfully migrated accounts to new structure")
-                    except Exception as e:
-                        print(f"Migration error (accounts structure): {e}")
+                migrations.migrate(conn)
             finally:
                 conn.close()
 
@@ -197,6 +366,7 @@ class DatabaseManager:
             with conn:
                 # 由于设置了外键级联删除，删除账号会自动删除关联的频道
                 conn.execute("DELETE FROM accounts WHERE id=?", (acc_id,))
+            self.channels_version += 1
         finally:
             conn.close()
 
@@ -233,10 +403,12 @@ class DatabaseManager:
         try:
             with conn:
                 cursor = conn.execute('''
-                    INSERT INTO channels (account_id, channel_id, channel_name, enabled, custom_path)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (data['account_id'], data['channel_id'], data.get('channel_name', data['channel_id']), data.get('enabled', 1), data.get('custom_path', '')))
-                return cursor.lastrowid
+                    INSERT INTO channels (account_id, channel_id, channel_name, enabled, custom_path, priority, weight, dedup_policy)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (data['account_id'], data['channel_id'], data.get('channel_name', data['channel_id']), data.get('enabled', 1), data.get('custom_path', ''),
+                      int(data.get('priority') or 0), max(1, int(data.get('weight') or 1)), _dedup_policy(data)))
+            self.channels_version += 1
+            return cursor.lastrowid
         finally:
             conn.close()
 
@@ -246,9 +418,12 @@ class DatabaseManager:
         try:
             with conn:
                 conn.execute('''
-                    UPDATE channels SET channel_id=?, channel_name=?, enabled=?, custom_path=?
+                    UPDATE channels SET channel_id=?, channel_name=?, enabled=?, custom_path=?,
+                        priority=COALESCE(?, priority), weight=COALESCE(?, weight), dedup_policy=COALESCE(?, dedup_policy)
                     WHERE id=?
-                ''', (data['channel_id'], data.get('channel_name', data['channel_id']), data.get('enabled', 1), data.get('custom_path', ''), ch_id))
+                ''', (data['channel_id'], data.get('channel_name', data['channel_id']), data.get('enabled', 1), data.get('custom_path', ''),
+                      _channel_priority(data), _channel_weight(data), _dedup_policy(data) if 'dedup_policy' in data else None, ch_id))
+            self.channels_version += 1
         finally:
             conn.close()
 
@@ -258,6 +433,7 @@ class DatabaseManager:
         try:
             with conn:
                 conn.execute("DELETE FROM channels WHERE id=?", (ch_id,))
+            self.channels_version += 1
         finally:
             conn.close()
 
@@ -270,8 +446,8 @@ class DatabaseManager:
                 if row:
                     new_status = 0 if row[0] else 1
                     conn.execute("UPDATE channels SET enabled=? WHERE id=?", (new_status, ch_id))
-                    return new_status
-                return 0
+            self.channels_version += 1
+            return new_status if row else 0
         finally:
             conn.close()
 
@@ -297,6 +473,7 @@ class DatabaseManager:
                     INSERT INTO notifications (name, type, config, enabled)
                     VALUES (?, ?, ?, ?)
                 ''', (data['name'], data['type'], json.dumps(data['config']), data.get('enabled', 1)))
+            self.notifications_version += 1
         finally:
             conn.close()
 
@@ -308,6 +485,7 @@ class DatabaseManager:
                     UPDATE notifications SET name=?, type=?, config=?, enabled=?
                     WHERE id=?
                 ''', (data['name'], data['type'], json.dumps(data['config']), data.get('enabled', 1), n_id))
+            self.notifications_version += 1
         finally:
             conn.close()
 
@@ -316,33 +494,77 @@ class DatabaseManager:
         try:
             with conn:
                 conn.execute("DELETE FROM notifications WHERE id=?", (n_id,))
+            self.notifications_version += 1
         finally:
             conn.close()
 
     # --- 基础设置 ---
-    def get_setting(self, key: str, default: Any = None) -> Any:
-        conn = self._get_connection()
+    @staticmethod
+    def _decode_setting(value: str) -> Any:
         try:
-            row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-            if row:
+            return json.loads(value)
+        except:
+            return value
+
+    def _load_settings(self) -> Dict:
+        with self._settings_lock:
+            if self._settings is None:
+                conn = self._get_connection()
                 try:
-                    return json.loads(row['value'])
-                except:
-                    return row['value']
-            return default
-        finally:
-            conn.close()
+                    rows = conn.execute("SELECT key, value FROM settings").fetchall()
+                    self._settings = {row['key']: self._decode_setting(row['value']) for row in rows}
+                finally:
+                    conn.close()
+            return self._settings
 
-    def set_setting(self, key: str, value: Any):
-        conn = self._get_connection()
+    def invalidate_settings(self):
+        """丢弃设置缓存，下次读取时重新加载（用于绕过 set_setting 直接修改数据库的情况）"""
+        with self._settings_lock:
+            self._settings = None
+
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        settings = self._settings
+        if settings is None:
+            settings = self._load_settings()
+        return settings.get(key, default)
+
+    def get_int_setting(self, key: str, default: int, minimum: int = None) -> int:
         try:
-            with conn:
-                conn.execute(
-                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                    (key, json.dumps(value, ensure_ascii=False))
-                )
-        finally:
-            conn.close()
+            value = int(self.get_setting(key, default))
+        except (ValueError, TypeError):
+            value = default
+        return max(minimum, value) if minimum is not None else value
+
+    def get_float_setting(self, key: str, default: float, minimum: float = None) -> float:
+        try:
+            value = float(self.get_setting(key, default))
+        except (ValueError, TypeError):
+            value = default
+        return max(minimum, value) if minimum is not None else value
+
+    def get_bool_setting(self, key: str, default: bool = False) -> bool:
+        value = self.get_setting(key, default)
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+
+    def set_setting(self, key: str, value: Any):
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self._settings_lock:
+            conn = self._get_connection()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                        (key, encoded)
+                    )
+            finally:
+                conn.close()
+            # 写穿：替换为新字典，其他线程的无锁读取始终看到完整的快照
+            if self._settings is not None:
+                settings = dict(self._settings)
+                settings[key] = self._decode_setting(encoded)
+                self._settings = settings
 
     # --- 用户管理 ---
     def get_user(self, username: str) -> Optional[Dict]:
@@ -376,13 +598,100 @@ class DatabaseManager:
             conn.close()
 
     # --- 任务管理 ---
+    def _task_filters(self, conn, status=None, account_id: int = None, channel_id: int = None,
+                      since: str = None, until: str = None, keyword: str = None):
+        """把筛选条件转换为 WHERE 子句与参数"""
+        where, params = [], []
+        if status:
+            statuses = status if isinstance(status, (list, tuple)) else str(status).split(',')
+            statuses = [s.strip() for s in statuses if s.strip()]
+            where.append(f"t.status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if account_id:
+            where.append("t.account_id = ?")
+            params.append(account_id)
+        if channel_id:
+            where.append("t.channel_id = ?")
+            params.append(channel_id)
+        if since:
+            where.append("t.start_time >= ?")
+            params.append(since)
+        if until:
+            # 只给日期时包含当天
+            where.append("t.start_time <= ?")
+            params.append(f"{until} 23:59:59" if len(until) == 10 else until)
+        keyword = (keyword or '').strip()
+        if keyword:
+            if self._fts is None:
+                self._fts = migrations.fts_available(conn)
+            # trigram 至少需要 3 个字符
+            if self._fts and len(keyword) >= 3:
+                where.append("t.id IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?)")
+                params.append('"' + keyword.replace('"', '""') + '"')
+            else:
+                pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                where.append("(t.file_name LIKE ? ESCAPE '\\' OR t.caption LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern])
+        return where, params
+
+    def _count_tasks(self, conn, where: list, params: list):
+        """统计条数，最多数到 TASK_COUNT_CAP，结果缓存 TASK_COUNT_TTL 秒；返回 (count, 是否被截断)"""
+        key = (tuple(where), tuple(params))
+        now = time.monotonic()
+        cached = self._count_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        sql = "SELECT COUNT(*) FROM (SELECT 1 FROM tasks t"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " LIMIT ?)"
+        count = conn.execute(sql, params + [TASK_COUNT_CAP + 1]).fetchone()[0]
+        result = (min(count, TASK_COUNT_CAP), count > TASK_COUNT_CAP)
+        if len(self._count_cache) >= 256:
+            self._count_cache.clear()
+        self._count_cache[key] = (now + TASK_COUNT_TTL, result)
+        return result
+
+    def search_tasks(self, cursor: int = None, limit: int = 20, **filters) -> Dict:
+        """
+        按 id 倒序的游标分页查询任务历史。
+        cursor 为上一页返回的 next_cursor，筛选条件见 _task_filters；
+        total 为近似条数（超过 TASK_COUNT_CAP 时截断，total_capped 为 True）。
+        """
+        self.task_writer.flush()
+        conn = self._get_connection()
+        try:
+            where, params = self._task_filters(conn, **filters)
+            total, capped = self._count_tasks(conn, where, params)
+            if cursor:
+                where = where + ["t.id < ?"]
+                params = params + [cursor]
+            rows = conn.execute(f'''
+                SELECT t.*, a.name as account_name, c.channel_name
+                FROM tasks t
+                LEFT JOIN accounts a ON t.account_id = a.id
+                LEFT JOIN channels c ON t.channel_id = c.id
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY t.id DESC LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+            items = [dict(row) for row in rows[:limit]]
+            return {
+                'total': total,
+                'total_capped': capped,
+                'limit': limit,
+                'next_cursor': items[-1]['id'] if len(rows) > limit else None,
+                'list': items
+            }
+        finally:
+            conn.close()
+
     def get_tasks(self, page: int = 1, limit: int = 20) -> Dict:
+        """页码分页（兼容旧客户端），深翻页请使用 search_tasks"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             offset = (page - 1) * limit
-            
-            # 获取总数
-            total = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            total, _ = self._count_tasks(conn, [], [])
             
             # 获取数据 (关联查询以获取账号名称和频道名称)
             # channel_id 在 tasks 表中可能为空（旧数据），或者对应 channels 表中的数据库ID
@@ -404,73 +713,147 @@ class DatabaseManager:
             conn.close()
 
     def add_task(self, task_data: Dict) -> int:
-        conn = self._get_connection()
-        try:
-            with conn:
-                cursor = conn.execute('''
-                    INSERT INTO tasks (account_id, message_id, file_name, file_size, status, start_time, file_path, channel_id, source_message_id, source_channel_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    task_data.get('account_id'),
-                    task_data.get('message_id'),
-                    task_data.get('file_name'),
-                    task_data.get('file_size'),
-                    task_data.get('status', 'downloading'),
-                    task_data.get('start_time'),
-                    task_data.get('file_path'),
-                    task_data.get('channel_id'),
-                    task_data.get('source_message_id'),
-                    task_data.get('source_channel_id')
-                ))
-                return cursor.lastrowid
-        finally:
-            conn.close()
+        """登记新任务并立即返回预分配的 id，由 TaskWriter 批量写入"""
+        data = {col: task_data.get(col) for col in TASK_COLUMNS}
+        data['status'] = task_data.get('status', 'downloading')
+        data['priority'] = task_data.get('priority', 0)
+        return self.task_writer.insert(data)
 
     def get_unfinished_tasks_by_account(self, account_id: int) -> List[Dict]:
         """获取某个账号下所有未完成（正在下载或等待中）的任务"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             rows = conn.execute('''
                 SELECT * FROM tasks 
                 WHERE account_id = ? AND status IN ('downloading', 'waiting')
-                ORDER BY id ASC
+                ORDER BY +id ASC -- 走 (account_id, status) 索引后再排序，避免按 id 扫描该账号的全部历史
             ''', (account_id,)).fetchall()
             return [dict(row) for row in rows]
         finally:
             conn.close()
 
-    def update_task_status(self, task_id: int, status: str, end_time: str = None, error_msg: str = None, start_time: str = None):
+    def get_active_file_paths(self, flush: bool = True) -> List[str]:
+        """未完成任务预定的保存路径（用于初始化文件名占用表）；flush=False 时只读已提交的记录"""
+        if flush:
+            self.task_writer.flush()
         conn = self._get_connection()
         try:
-            with conn:
-                if end_time:
-                    conn.execute(
-                        "UPDATE tasks SET status = ?, end_time = ?, error_msg = ? WHERE id = ?",
-                        (status, end_time, error_msg, task_id)
-                    )
-                elif start_time:
-                    conn.execute(
-                        "UPDATE tasks SET status = ?, start_time = ? WHERE id = ?",
-                        (status, start_time, task_id)
-                    )
-                else:
-                    conn.execute(
-                        "UPDATE tasks SET status = ? WHERE id = ?",
-                        (status, task_id)
-                    )
+            rows = conn.execute('''
+                SELECT file_path FROM tasks
+                WHERE status IN ('downloading', 'waiting') AND file_path IS NOT NULL
+            ''').fetchall()
+            return [row[0] for row in rows]
         finally:
             conn.close()
 
+    def update_task_status(self, task_id: int, status: str, end_time: str = None, error_msg: str = None,
+                           start_time: str = None, flush: bool = None):
+        """登记状态变更；flush 默认在进入终态（完成/失败）时立即提交"""
+        fields = {'status': status}
+        if end_time:
+            fields.update(end_time=end_time, error_msg=error_msg)
+        elif start_time:
+            fields['start_time'] = start_time
+        if error_msg:
+            fields['error_msg'] = error_msg
+        self.task_writer.update(task_id, fields)
+        if flush or (flush is None and status in TERMINAL_STATUSES):
+            self.task_writer.flush()
+
+    def update_task_file(self, task_id: int, file_name: str, file_path: str):
+        self.task_writer.update(task_id, {'file_name': file_name, 'file_path': file_path})
+
+    def update_task_timings(self, task_id: int, timings: Dict, avg_speed: float = None, resume_count: int = None):
+        """登记任务的阶段耗时（随之后的状态变更一起提交）"""
+        fields = {'timings': json.dumps(timings, separators=(',', ':'))}
+        if avg_speed is not None:
+            fields['avg_speed'] = avg_speed
+        if resume_count is not None:
+            fields['resume_count'] = resume_count
+        self.task_writer.update(task_id, fields)
+
+    def update_task_message_id(self, task_id: int, message_id: int):
+        self.task_writer.update(task_id, {'message_id': message_id})
+
+    def get_task(self, task_id: int) -> Optional[Dict]:
+        self.task_writer.flush()
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def update_task_priority(self, task_id: int, priority: int):
+        self.task_writer.update(task_id, {'priority': priority})
+
     def delete_task(self, task_id: int):
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             with conn:
                 conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            self._count_cache.clear()
+        finally:
+            conn.close()
+
+    def add_media_file(self, task_id: int, document_id: int, access_hash: int, file_size: int, content_hash: str = None):
+        """记录已完成任务的媒体指纹"""
+        conn = self._get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO media_files (task_id, document_id, access_hash, file_size, content_hash)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (task_id, document_id, access_hash, file_size, content_hash))
+        finally:
+            conn.close()
+
+    def find_media_files(self, file_size: int, document_id: int = None, content_hash: str = None) -> List[Dict]:
+        """按文档 ID 或内容哈希查找已完成任务的文件，最新的在前"""
+        column, value = ('document_id', document_id) if document_id is not None else ('content_hash', content_hash)
+        self.task_writer.flush()
+        conn = self._get_connection()
+        try:
+            rows = conn.execute(f'''
+                SELECT m.*, t.file_path FROM media_files m JOIN tasks t ON t.id = m.task_id
+                WHERE m.{column} = ? AND m.file_size = ? AND t.status = 'completed'
+                ORDER BY m.task_id DESC LIMIT 10
+            ''', (value, file_size)).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def get_completed_files(self) -> List[Dict]:
+        """已完成且记录了保存路径的任务（淘汰引擎启动时加载）"""
+        self.task_writer.flush()
+        conn = self._get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT id, file_path, end_time FROM tasks
+                WHERE status = 'completed' AND file_path IS NOT NULL
+            ''').fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def get_failed_files(self) -> List[Dict]:
+        """失败或停止且记录了保存路径的任务，其 .part 可能仍保留在磁盘上（淘汰引擎启动时加载）"""
+        self.task_writer.flush()
+        conn = self._get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT id, file_path, end_time FROM tasks
+                WHERE status IN ('failed', 'stopped') AND file_path IS NOT NULL
+            ''').fetchall()
+            return [dict(row) for row in rows]
         finally:
             conn.close()
 
     def get_expired_tasks(self, cutoff_time: str) -> List[Dict]:
         """获取早于 cutoff_time 且状态为 completed 的任务"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             rows = conn.execute('''
@@ -483,17 +866,23 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def clear_tasks(self):
+    def clear_tasks(self) -> List[str]:
+        """清除非活跃任务，返回其中未完成任务（失败、停止）的保存路径，供调用方清理 .part"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             with conn:
+                rows = conn.execute("SELECT file_path FROM tasks WHERE status IN ('failed', 'stopped')").fetchall()
                 # 只清除已完成、失败或停止的任务，保留下载中和等待中的
                 conn.execute("DELETE FROM tasks WHERE status NOT IN ('downloading', 'waiting')")
+            self._count_cache.clear()
+            return [row['file_path'] for row in rows if row['file_path']]
         finally:
             conn.close()
 
     def get_active_task_count(self) -> int:
         """获取当前正在下载的任务数（不含等待中）用于并发控制"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             return conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'downloading'").fetchone()[0]
@@ -502,6 +891,7 @@ class DatabaseManager:
             
     def get_active_tasks(self) -> List[Dict]:
         """获取所有活跃任务（包含正在下载和排队等待的）"""
+        self.task_writer.flush()
         conn = self._get_connection()
         try:
             rows = conn.execute('''
@@ -516,4 +906,31 @@ class DatabaseManager:
         finally:
             conn.close()
 
+def _timed(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.monotonic() - started, name)
+    return wrapper
+
+
+# 不访问数据库的公开方法：设置读取走缓存，任务写入只在内存中登记（批次提交耗时见 DB_WRITE_BATCH_SECONDS）
+_UNTIMED = {
+    'close', 'flush_tasks', 'invalidate_settings',
+    'get_setting', 'get_int_setting', 'get_float_setting', 'get_bool_setting',
+    'add_task', 'update_task_status', 'update_task_file', 'update_task_timings',
+    'update_task_message_id', 'update_task_priority',
+}
+
+# 为执行 SQL 的公开方法记录耗时（按方法名分组的直方图，见 /metrics）；设置缓存未命中时的加载单独计入 load_settings
+for _name, _method in list(vars(DatabaseManager).items()):
+    if callable(_method) and not _name.startswith('_') and _name not in _UNTIMED:
+        setattr(DatabaseManager, _name, _timed(_name, _method))
+DatabaseManager._load_settings = _timed('load_settings', DatabaseManager._load_settings)
+
 db_manager = DatabaseManager()
+
+metrics.Gauge('tg_db_pending_task_writes', '尚未提交的任务写入数', lambda: db_manager.task_writer.pending)
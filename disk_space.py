@@ -0,0 +1,201 @@
+import os
+import errno
+import ctypes
+import asyncio
+import logging
+import threading
+import collections
+
+import download_engine
+import metrics
+from scheduler import call_soon_in
+
+# 每个文件系统保留的余量，避免下载把数据库与日志所在的卷写满
+SAFETY_MARGIN = 100 * 1024 * 1024
+# 等待空间时的重新检查间隔（秒）：空间也可能被淘汰引擎或外部程序释放，不只是其他下载结束
+RECHECK_INTERVAL = 5
+# linux/falloc.h
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _fallocate = _libc.fallocate
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+except (OSError, AttributeError): # 非 Linux 平台
+    _fallocate = None
+
+
+def _allocated(path: str) -> int:
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+def preallocate(path: str, size: int) -> bool:
+    """为文件预分配 size 字节的磁盘块（阻塞 IO）；平台或文件系统不支持时返回 False"""
+    if not hasattr(os, 'posix_fallocate'):
+        return False
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError as e:
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            return False
+        raise
+    finally:
+        os.close(fd)
+
+
+def _punch_hole(fd: int, offset: int, length: int) -> bool:
+    if _fallocate is None:
+        return False
+    if _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        if err in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            return False
+        raise OSError(err, os.strerror(err))
+    return True
+
+
+def release_unwritten(file_path: str, chunk_map=None):
+    """
+    下载失败后归还 .part 中预分配但未写入的空间（阻塞 IO，应在线程中调用），已完成的分块保留用于续传：
+    截断到最后一个已完成分块的末尾，中间缺失的分块在支持的文件系统上打洞释放。
+    没有分块位图（顺序下载无法续传）或一个分块都没有完成时删除中间文件。
+    续传时 reserve() 按 .part 实际已分配的部分重新预留并预分配。
+    """
+    done = [i for i, crc in enumerate(chunk_map.crcs) if crc is not None] if chunk_map else []
+    if not done:
+        download_engine.discard(file_path)
+        return
+    part = download_engine.part_path(file_path)
+    end = min(chunk_map.total_size, (done[-1] + 1) * chunk_map.chunk_size)
+    fd = os.open(part, os.O_WRONLY)
+    try:
+        os.ftruncate(fd, end)
+        for start, count in chunk_map.missing_runs():
+            if start > done[-1]:
+                break
+            if not _punch_hole(fd, start * chunk_map.chunk_size, count * chunk_map.chunk_size):
+                break
+    finally:
+        os.close(fd)
+
+
+class Reservation:
+    def __init__(self, dev: int, size: int):
+        self.dev = dev
+        self.size = size
+
+
+class DiskSpaceReservations:
+    """
+    下载开始前的磁盘空间准入控制（跨线程、跨事件循环共享）。
+    每个文件系统（按 st_dev，自定义路径挂载到其他卷时分别计算）记录已预留但尚未真正占用的字节数，
+    新下载只有在 可用空间 - 已预留 - 余量 足够时才被放行，否则在队列中等待，而不是写到一半因空间不足失败。
+    放行后立即用 fallocate 为 .part 预分配全部空间，成功后预留即转为实际占用；
+    不支持预分配时预留保持到下载结束。
+    """
+
+    def __init__(self, margin: int = SAFETY_MARGIN):
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._reserved = collections.Counter() # st_dev -> 字节数
+        self._waiters = [] # [(loop, future)]
+
+    @property
+    def reserved(self) -> int:
+        return sum(self._reserved.values())
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _try_reserve(self, directory: str, need: int):
+        st = os.statvfs(directory)
+        dev = os.stat(directory).st_dev
+        capacity = st.f_blocks * st.f_frsize - self.margin
+        if need > capacity:
+            raise OSError(errno.ENOSPC, f"文件大小 {need / 1024 ** 3:.2f}GB 超过磁盘容量")
+        with self._lock:
+            free = st.f_bavail * st.f_frsize - self._reserved[dev] - self.margin
+            if need > free:
+                return None
+            self._reserved[dev] += need
+            return Reservation(dev, need)
+
+    async def reserve(self, file_path: str, size: int, on_wait=None, wait: bool = True) -> Reservation:
+        """
+        为 file_path 预留 size 字节并预分配 .part，空间不足时等待。
+        已存在的 .part（续传）中已分配的部分不重复计算。
+        on_wait: 可选回调，第一次需要等待时调用
+        wait: 为 False 时空间不足直接返回 None，调用方可先释放其他资源再等待
+        """
+        part = download_engine.part_path(file_path)
+        directory = os.path.dirname(file_path) or '.'
+        loop = asyncio.get_running_loop()
+        waited = False
+        while True:
+            need = max(0, size - _allocated(part))
+            reservation = await asyncio.to_thread(self._try_reserve, directory, need)
+            if reservation:
+                break
+            if not wait:
+                return None
+            if not waited:
+                waited = True
+                logging.info(f"💾 磁盘空间不足，等待释放后再下载: {os.path.basename(file_path)} ({size / 1024 ** 3:.2f}GB)")
+                if on_wait: on_wait()
+            fut = loop.create_future()
+            waiter = (loop, fut)
+            with self._lock:
+                self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(fut, RECHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+        if need:
+            try:
+                if await asyncio.to_thread(preallocate, part, size):
+                    # 空间已实际分配，计入文件系统的已用空间，不再需要额外预留
+                    self.release(reservation)
+                    reservation = Reservation(reservation.dev, 0)
+            except OSError:
+                self.release(reservation)
+                raise
+        return reservation
+
+    def release(self, reservation: Reservation):
+        if not reservation or not reservation.size:
+            return
+        with self._lock:
+            self._reserved[reservation.dev] -= reservation.size
+            if self._reserved[reservation.dev] <= 0:
+                del self._reserved[reservation.dev]
+            reservation.size = 0
+        self.wake()
+
+    def wake(self):
+        """空间可能已释放（预留归还、文件被删除）时唤醒等待者立即重新检查"""
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, fut in waiters:
+            try:
+                call_soon_in(loop, lambda f=fut: f.done() or f.set_result(None))
+            except RuntimeError:
+                # 等待者所在的事件循环已关闭
+                pass
+
+
+disk_space = DiskSpaceReservations()
+
+metrics.Gauge('tg_disk_reserved_bytes', '已预留但尚未分配的磁盘空间', lambda: disk_space.reserved)
+metrics.Gauge('tg_disk_space_waiting', '等待磁盘空间的下载数', lambda: disk_space.waiting)
@@ -0,0 +1,148 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+
+# fsync 策略: none=交给系统回写, close=关闭文件前 fsync 一次, interval=每写入固定字节数 fsync 一次
+FSYNC_POLICIES = ('none', 'close', 'interval')
+FSYNC_INTERVAL_BYTES = 64 * 1024 * 1024
+
+_STOP = object()
+
+
+class DiskWriter:
+    """
+    专用线程写盘器。
+    下载协程通过有界队列把 memoryview 交给写线程，不做拷贝；磁盘（或 NFS）再慢也只会让
+    生产者在 await write() 上等待缓冲区，而不会阻塞整个事件循环。
+    """
+
+    def __init__(self, file_path: str, append: bool = False, size: int = None,
+                 fsync_policy: str = 'close', max_buffers: int = 16):
+        self.file_path = file_path
+        self.append = append
+        self.size = size
+        self.fsync_policy = fsync_policy if fsync_policy in FSYNC_POLICIES else 'close'
+        self.bytes_written = 0
+        # 写线程实际花在 write / fsync 上的时间（秒），与下载并行，用于判断瓶颈是否在磁盘
+        self.busy_seconds = 0.0
+
+        self._queue = queue.Queue()
+        self._slots = asyncio.Semaphore(max_buffers)
+        self._loop = asyncio.get_running_loop()
+        self._opened = self._loop.create_future()
+        self._closed = self._loop.create_future()
+        self._error = None
+        self._fd = None
+        self._thread = threading.Thread(target=self._run, name=f"disk-writer:{os.path.basename(file_path)}", daemon=True)
+
+    @property
+    def error(self):
+        """写线程遇到的写盘错误（如 ENOSPC、EIO），出错后不再写入，None 表示正常"""
+        return self._error
+
+    @classmethod
+    async def open(cls, file_path: str, **kwargs) -> 'DiskWriter':
+        """创建写盘器并在写线程中打开文件（打开本身也可能在慢盘上阻塞）"""
+        writer = cls(file_path, **kwargs)
+        writer._thread.start()
+        await writer._opened
+        return writer
+
+    async def write(self, data, offset: int = None, on_written=None):
+        """
+        提交一个缓冲区；offset 为 None 时顺序追加写。
+        on_written: 可选回调，数据成功写入文件后在事件循环中调用
+        """
+        if self._error:
+            raise self._error
+        await self._slots.acquire()
+        self._queue.put((memoryview(data), offset, on_written))
+
+    def call(self, func):
+        """在写线程中执行 func（排在此前提交的写入之后），用于分块位图等随写入落盘的小文件"""
+        self._queue.put((None, None, func))
+
+    async def close(self):
+        """等待队列写完、按策略 fsync 并关闭文件；写入过程中的错误在此抛出"""
+        self._queue.put(_STOP)
+        await self._closed
+        if self._error:
+            raise self._error
+
+    # --- 以下在写线程中执行 ---
+    def _call_soon(self, callback):
+        try:
+            self._loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # 事件循环已关闭（Bot 停止），无人再等待结果
+            pass
+
+    def _notify(self, fut, exc=None):
+        def done():
+            if fut.done(): return
+            if exc: fut.set_exception(exc)
+            else: fut.set_result(None)
+        self._call_soon(done)
+
+    def _run(self):
+        try:
+            flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.append else 0)
+            self._fd = os.open(self.file_path, flags, 0o644)
+            if self.size and not self.append:
+                os.ftruncate(self._fd, self.size)
+        except OSError as e:
+            self._error = e
+            self._notify(self._opened, e)
+            self._notify(self._closed)
+            return
+        self._notify(self._opened)
+
+        unsynced = 0
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            buf, offset, on_written = item
+            if buf is None:
+                try:
+                    on_written()
+                except Exception as e:
+                    logging.error(f"写线程任务失败 {self.file_path}: {e}")
+                continue
+            started = time.perf_counter()
+            try:
+                if self._error is None:
+                    written = 0
+                    while written < len(buf):
+                        if offset is None:
+                            written += os.write(self._fd, buf[written:])
+                        else:
+                            written += os.pwrite(self._fd, buf[written:], offset + written)
+                    self.bytes_written += len(buf)
+                    unsynced += len(buf)
+                    if self.fsync_policy == 'interval' and unsynced >= FSYNC_INTERVAL_BYTES:
+                        os.fsync(self._fd)
+                        unsynced = 0
+                    if on_written:
+                        self._call_soon(on_written)
+            except OSError as e:
+                logging.error(f"写入文件失败 {self.file_path}: {e}")
+                self._error = e
+            finally:
+                self.busy_seconds += time.perf_counter() - started
+                buf.release()
+                self._call_soon(self._slots.release)
+
+        started = time.perf_counter()
+        try:
+            if self._error is None and self.fsync_policy != 'none' and unsynced:
+                os.fsync(self._fd)
+        except OSError as e:
+            self._error = e
+        finally:
+            os.close(self._fd)
+            self.busy_seconds += time.perf_counter() - started
+            self._notify(self._closed)
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import base64
+import asyncio
+import logging
+from collections import deque
+from disk_writer import DiskWriter
+
+# 分块（位图、CRC 与续传）的粒度。Telethon 会把 request_size 截到 512KB（MAX_CHUNK_SIZE），
+# 因此每个 1MB 分块经其通用迭代器由两个对齐的 512KB GetFile 请求拼成，不会走直连下载路径；
+# 保持 1MB 是为了兼容已有的 .part.map 与内容指纹（两者都包含分块大小）
+CHUNK_SIZE = 1024 * 1024
+# 下载中的数据写入 .part 文件，分块完成情况记录在 sidecar 中，完成后原子重命名为最终文件
+PART_SUFFIX = '.part'
+MAP_SUFFIX = '.part.map'
+# 分块位图落盘间隔（秒）
+MAP_SAVE_INTERVAL = 5
+# 单个区间请求流中断后的重试次数（连续失败计数，取得新块后清零）与指数退避（秒）
+RANGE_RETRIES = 5
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 30
+
+
+def part_path(file_path: str) -> str:
+    return file_path + PART_SUFFIX
+
+
+def map_path(file_path: str) -> str:
+    return file_path + MAP_SUFFIX
+
+
+def discard(file_path: str):
+    """删除下载中间文件（.part 及其分块位图）"""
+    for p in (part_path(file_path), map_path(file_path)):
+        try: os.remove(p)
+        except OSError: pass
+
+
+class ChunkMap:
+    """
+    .part 文件的分块完成位图。
+    每个已完成的块记录其 CRC32，续传前读回 .part 逐块校验，写入不完整或被覆盖的块会重新下载；
+    media_id 与文件大小用于识别 .part 是否属于同一个媒体，不匹配则从头下载。
+    """
+
+    def __init__(self, file_path: str, total_size: int, media_id: str, chunk_size: int = None):
+        self.file_path = file_path
+        self.total_size = total_size
+        self.media_id = str(media_id)
+        # 默认在创建时读取模块级 CHUNK_SIZE，便于基准测试调整分块大小
+        self.chunk_size = chunk_size = chunk_size or CHUNK_SIZE
+        self.count = (total_size + chunk_size - 1) // chunk_size
+        self.crcs = [None] * self.count
+        self._dirty = False
+        self._last_save = 0
+
+    @classmethod
+    def load(cls, file_path: str, total_size: int, media_id: str) -> 'ChunkMap':
+        chunk_map = cls(file_path, total_size, media_id)
+        # 没有位图的 .part 是刚预分配的空文件（见 disk_space），从头下载
+        if not os.path.exists(part_path(file_path)) or not os.path.exists(map_path(file_path)):
+            return chunk_map
+        try:
+            with open(map_path(file_path), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('size') != total_size or data.get('media_id') != chunk_map.media_id \
+                    or data.get('chunk_size') != chunk_map.chunk_size or len(data.get('crc', [])) != chunk_map.count:
+                logging.warning(f"分块位图与当前媒体不匹配，将重新下载: {os.path.basename(file_path)}")
+                return chunk_map
+            chunk_map.crcs = data['crc']
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"读取分块位图失败，将重新下载 {os.path.basename(file_path)}: {e}")
+        return chunk_map
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def mark(self, index: int, crc: int):
+        self.crcs[index] = crc
+        self._dirty = True
+
+    @property
+    def done_count(self) -> int:
+        return sum(1 for c in self.crcs if c is not None)
+
+    @property
+    def done_bytes(self) -> int:
+        return sum(self.chunk_length(i) for i, c in enumerate(self.crcs) if c is not None)
+
+    @property
+    def complete(self) -> bool:
+        return all(c is not None for c in self.crcs)
+
+    def missing_runs(self):
+        """返回缺失块的连续区间 [(起始块序号, 块数), ...]"""
+        runs = []
+        start = None
+        for i, c in enumerate(self.crcs):
+            if c is None and start is None:
+                start = i
+            elif c is not None and start is not None:
+                runs.append((start, i - start))
+                start = None
+        if start is not None:
+            runs.append((start, self.count - start))
+        return runs
+
+    def verify(self) -> int:
+        """读回 .part 校验已完成块的 CRC，返回被判定为损坏的块数（阻塞 IO，应在线程中调用）"""
+        invalid = 0
+        try:
+            with open(part_path(self.file_path), 'rb') as f:
+                for i, crc in enumerate(self.crcs):
+                    if crc is None: continue
+                    f.seek(i * self.chunk_size)
+                    data = f.read(self.chunk_length(i))
+                    if len(data) != self.chunk_length(i) or zlib.crc32(data) != crc:
+                        self.crcs[i] = None
+                        invalid += 1
+        except OSError:
+            invalid = self.done_count
+            self.crcs = [None] * self.count
+        if invalid:
+            self._dirty = True
+        return invalid
+
+    def fingerprint(self) -> str:
+        """由文件大小与各分块 CRC 组合出的内容指纹，无需重新读取文件；所有分块完成后才有意义"""
+        digest = hashlib.sha256(f"{self.total_size}:{self.chunk_size}:".encode())
+        for crc in self.crcs:
+            digest.update(crc.to_bytes(4, 'little'))
+        return digest.hexdigest()
+
+    def save(self, force: bool = False, writer: DiskWriter = None):
+        """
+        原子写入位图（先写临时文件再 rename），未到落盘间隔时跳过。
+        writer: 给定时在其写线程中序列化并落盘，不阻塞事件循环；否则在当前线程写入
+        """
+        now = time.monotonic()
+        if not self._dirty or (not force and now - self._last_save < MAP_SAVE_INTERVAL):
+            return
+        crcs = list(self.crcs)
+        self._dirty = False
+        self._last_save = now
+        if writer:
+            writer.call(lambda: self._write(crcs))
+        else:
+            self._write(crcs)
+
+    def _write(self, crcs: list):
+        bitmap = bytearray((self.count + 7) // 8)
+        for i, c in enumerate(crcs):
+            if c is not None:
+                bitmap[i // 8] |= 1 << (i % 8)
+        data = {
+            'size': self.total_size,
+            'media_id': self.media_id,
+            'chunk_size': self.chunk_size,
+            'bitmap': base64.b64encode(bytes(bitmap)).decode(),
+            'crc': crcs
+        }
+        tmp = map_path(self.file_path) + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, map_path(self.file_path))
+        except OSError as e:
+            logging.error(f"保存分块位图失败 {self.file_path}: {e}")
+            self._dirty = True
+
+
+async def open_chunk_map(file_path: str, total_size: int, media_id) -> ChunkMap:
+    """加载已有的分块位图并在线程中校验 .part 内容"""
+    chunk_map = ChunkMap.load(file_path, total_size, media_id)
+    if chunk_map.done_count:
+        invalid = await asyncio.to_thread(chunk_map.verify)
+        if invalid:
+            logging.warning(f"续传校验: {invalid} 个分块损坏，将重新下载: {os.path.basename(file_path)}")
+    return chunk_map
+
+
+def plan_ranges(runs, connections: int):
+    """把缺失区间切分成不少于 connections 份（在块数允许时），返回 [(起始块序号, 块数), ...]"""
+    total = sum(count for _, count in runs)
+    if total == 0:
+        return []
+    per_range = max(1, (total + connections - 1) // connections)
+    ranges = []
+    for start, count in runs:
+        while count > 0:
+            take = min(count, per_range)
+            ranges.append((start, take))
+            start += take
+            count -= take
+    return ranges
+
+
+async def _download_range(client, media, writer, chunk_map, start, count, on_chunk):
+    """
+    下载连续的若干块，逐块校验长度、记录 CRC 并交给写盘线程。
+    请求流中断时从下一个未取到的块重新发起请求，按指数退避最多连续重试 RANGE_RETRIES 次；
+    FloodWait 按服务器要求的秒数等待。本地写盘出错（磁盘满、I/O 错误）时重试无济于事，立即抛出。
+    """
+    index = start
+    end = start + count
+    failures = 0
+    while index < end:
+        try:
+            async for chunk in client.iter_download(
+                media,
+                offset=index * chunk_map.chunk_size,
+                limit=end - index,
+                request_size=chunk_map.chunk_size
+            ):
+                expected = chunk_map.chunk_length(index)
+                if len(chunk) < expected:
+                    raise IOError(f"分块 {index} 长度不足 ({len(chunk)}/{expected})")
+                chunk = chunk[:expected]
+                crc = zlib.crc32(chunk)
+                # 数据真正写入 .part 后才标记完成，避免位图领先于文件内容
+                await writer.write(chunk, index * chunk_map.chunk_size,
+                                   on_written=lambda i=index, c=crc: chunk_map.mark(i, c))
+                await on_chunk(expected)
+                chunk_map.save(writer=writer)
+                index += 1
+                failures = 0
+                if index >= end:
+                    break
+            if index != end:
+                raise IOError(f"分块 {start}-{end - 1} 下载不完整 (实际到 {index - 1})")
+        except Exception as e:
+            if writer.error is not None:
+                raise writer.error
+            failures += 1
+            if failures > RANGE_RETRIES:
+                raise
+            delay = getattr(e, 'seconds', None) or min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** (failures - 1))
+            logging.warning(f"分块 {index}-{end - 1} 下载中断 ({e})，{delay}s 后重试 ({failures}/{RANGE_RETRIES})")
+            await asyncio.sleep(delay)
+
+
+def _record_stats(stats, writer, received: float):
+    """下载结束时的计时：收完数据的时刻、写盘线程忙碌时间、落盘并重命名完成的时刻"""
+    if stats is None:
+        return
+    stats['received'] = received
+    stats['disk_write'] = writer.busy_seconds
+    stats['closed'] = time.monotonic()
+
+
+async def download_file(client, media, file_path: str, chunk_map: ChunkMap, connections: int = 4,
+                        progress=None, fsync_policy: str = 'close', stats: dict = None):
+    """
+    按分块位图下载文件的缺失部分。
+    缺失区间被拆分后由多路并发 GetFile 请求流拉取，按偏移写入预分配的 .part 文件；
+    全部块完成后原子重命名为最终文件。
+    progress: 可选的 async 回调，参数为当前已下载的总字节数（含续传前已完成部分）
+    stats: 可选的字典，写入 first_byte / received / closed（time.monotonic 时刻）与 disk_write（秒）
+    """
+    ranges = deque(plan_ranges(chunk_map.missing_runs(), max(1, connections)))
+    downloaded = chunk_map.done_bytes
+
+    async def on_chunk(size):
+        nonlocal downloaded
+        downloaded += size
+        if stats is not None and 'first_byte' not in stats:
+            stats['first_byte'] = time.monotonic()
+        if progress:
+            await progress(downloaded)
+
+    async def worker():
+        while ranges:
+            start, count = ranges.popleft()
+            await _download_range(client, media, writer, chunk_map, start, count, on_chunk)
+
+    writer = await DiskWriter.open(part_path(file_path), size=chunk_map.total_size, fsync_policy=fsync_policy,
+                                   max_buffers=max(16, connections * 2))
+    try:
+        if ranges:
+            workers = min(connections, len(ranges))
+            logging.info(f"⚡ {workers} 路下载 {len(ranges)} 个区间: {os.path.basename(file_path)} "
+                         f"({chunk_map.total_size / 1024 / 1024:.2f}MB, 已完成 {downloaded / 1024 / 1024:.2f}MB)")
+            tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # 任一区间失败则取消其余区间，避免残留请求继续占用连接
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        received = time.monotonic()
+    finally:
+        try:
+            await writer.close()
+        finally:
+            # 无论成功失败都落盘位图，已写入的块在重启后无需重新下载
+            await asyncio.to_thread(chunk_map.save, True)
+
+    if not chunk_map.complete:
+        raise IOError(f"下载结束但仍有 {chunk_map.count - chunk_map.done_count} 个分块缺失")
+    os.replace(part_path(file_path), file_path)
+    discard(file_path)
+    _record_stats(stats, writer, received)
+    return downloaded
+
+
+async def sequential_download(client, media, file_path: str, progress=None, fsync_policy: str = 'close',
+                              stats: dict = None):
+    """文件大小未知时的单连接顺序下载（无法分块续传），完成后原子重命名；stats 同 download_file"""
+    discard(file_path)
+    downloaded = 0
+    writer = await DiskWriter.open(part_path(file_path), append=True, fsync_policy=fsync_policy)
+    try:
+        async for chunk in client.iter_download(
+            media,
+            request_size=CHUNK_SIZE # Telethon 按 512KB 请求拼成 1MB 块
+        ):
+            if stats is not None and 'first_byte' not in stats:
+                stats['first_byte'] = time.monotonic()
+            await writer.write(chunk)
+            downloaded += len(chunk)
+            if progress:
+                await progress(downloaded)
+        received = time.monotonic()
+    finally:
+        await writer.close()
+    os.replace(part_path(file_path), file_path)
+    _record_stats(stats, writer, received)
+    return downloaded
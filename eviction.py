@@ -0,0 +1,241 @@
+import os
+import heapq
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from database import db_manager
+from filename_registry import filename_registry
+from disk_space import disk_space
+import download_engine
+import metrics
+
+# 后台检查间隔（秒）：每轮只做 statvfs 和堆顶比较，磁盘压力在数秒内即可得到处理
+CHECK_INTERVAL = 5
+# 单轮最多删除的文件数，余下的在下一轮继续
+EVICT_BATCH = 200
+GB = 1024 ** 3
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class _Volume:
+    """同一文件系统（st_dev）上受管理的文件：按完成（失败）时间排列的小顶堆及总大小"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.heap = []
+        self.bytes = 0
+        self.pressure = False
+
+
+class EvictionEngine:
+    """
+    已下载文件的淘汰引擎，替代每小时扫描一次过期任务的清理方式。
+    已完成任务的文件按所在文件系统分组，以完成时间为键放入小顶堆并累计大小：
+    - 保留期：完成时间早于 FILE_RETENTION_DAYS 天的文件被删除（只需比较堆顶）
+    - 水位：可用空间低于 DISK_FREE_LOW_GB 时从最旧的文件开始删除，直到恢复到 DISK_FREE_HIGH_GB
+    失败任务保留的 .part 以失败时间为键一并管理，按同样的规则删除（任务保持失败状态，重试时从头下载）。
+    后台线程每 CHECK_INTERVAL 秒检查一次，有文件下载完成时立即唤醒。
+    任务被删除或改名时旧条目只在索引中作废，弹出堆顶时跳过。
+    """
+
+    def __init__(self, db=db_manager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._volumes = {} # st_dev -> _Volume
+        self._entries = {} # task_id -> (end_time, task_id, 磁盘上的路径, size, st_dev, 任务的 file_path)
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='eviction', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if not thread:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join(timeout)
+
+    def wake(self):
+        """设置变更或写入大文件后立即检查一次"""
+        self._wakeup.set()
+
+    @property
+    def tracked_bytes(self) -> int:
+        return sum(volume.bytes for volume in self._volumes.values())
+
+    @property
+    def tracked_files(self) -> int:
+        return len(self._entries)
+
+    def load(self):
+        """从数据库加载已完成任务的文件和失败任务保留的 .part（启动时调用一次）"""
+        count = 0
+        for task in self.db.get_completed_files():
+            if self.track(task['id'], task['file_path'], task['end_time'], wake=False):
+                count += 1
+        for task in self.db.get_failed_files():
+            if self.track(task['id'], task['file_path'], task['end_time'], wake=False, partial=True):
+                count += 1
+        logging.info(f"淘汰引擎已加载 {count} 个文件，共 {self.tracked_bytes / GB:.2f} GB")
+
+    def track(self, task_id: int, file_path: str, end_time: str = None, wake: bool = True, partial: bool = False) -> bool:
+        """登记一个已完成的文件；partial 为真时登记失败任务保留的 .part。文件不存在时返回 False"""
+        path = download_engine.part_path(file_path) if partial and file_path else file_path
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            return False
+        if not end_time:
+            end_time = datetime.fromtimestamp(st.st_mtime).strftime(TIME_FORMAT)
+        # 预分配后被截断、打洞的 .part 按实际占用计算
+        size = min(st.st_size, st.st_blocks * 512) if partial else st.st_size
+        entry = (end_time, task_id, path, size, st.st_dev, file_path)
+        with self._lock:
+            self._untrack(task_id)
+            volume = self._volumes.get(st.st_dev)
+            if volume is None:
+                volume = self._volumes[st.st_dev] = _Volume(os.path.dirname(path))
+            heapq.heappush(volume.heap, entry)
+            volume.bytes += size
+            self._entries[task_id] = entry
+        if wake:
+            self._wakeup.set()
+        return True
+
+    def _untrack(self, task_id: int):
+        entry = self._entries.pop(task_id, None)
+        if entry:
+            self._volumes[entry[4]].bytes -= entry[3]
+
+    def untrack(self, task_id: int):
+        with self._lock:
+            self._untrack(task_id)
+
+    def clear(self):
+        """任务历史被清空时放弃管理全部文件（与清空前的行为一致，文件本身保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._volumes.clear()
+
+    def _pop(self, volume: _Volume):
+        """弹出堆顶的有效条目（跳过已作废的条目），没有时返回 None"""
+        while volume.heap:
+            entry = heapq.heappop(volume.heap)
+            if self._entries.get(entry[1]) is entry:
+                self._untrack(entry[1])
+                return entry
+        return None
+
+    def _peek(self, volume: _Volume):
+        while volume.heap and self._entries.get(volume.heap[0][1]) is not volume.heap[0]:
+            heapq.heappop(volume.heap)
+        return volume.heap[0] if volume.heap else None
+
+    @staticmethod
+    def _reclaimable(entry) -> int:
+        # 硬链接（重复媒体）只有删除最后一个链接才会释放空间
+        try:
+            st = os.stat(entry[2])
+        except OSError:
+            return 0
+        return st.st_blocks * 512 if st.st_nlink <= 1 else 0
+
+    def _select(self, retention_days: int, low: float, high: float) -> list:
+        victims = []
+        cutoff = (datetime.now() - timedelta(days=retention_days)).strftime(TIME_FORMAT) if retention_days > 0 else None
+        with self._lock:
+            for dev, volume in self._volumes.items():
+                if cutoff:
+                    while len(victims) < EVICT_BATCH:
+                        top = self._peek(volume)
+                        if top is None or top[0] >= cutoff:
+                            break
+                        victims.append((self._pop(volume), 'File cleaned up by retention policy'))
+                if low <= 0:
+                    continue
+                try:
+                    free = shutil.disk_usage(volume.path).free
+                except OSError:
+                    continue
+                # 上一轮已删除的文件在 statvfs 中已经体现，这里只需估算本轮将释放的空间
+                free += sum(self._reclaimable(e) for e, _ in victims if e[4] == dev)
+                if free >= (high if volume.pressure else low):
+                    volume.pressure = False
+                    continue
+                if not volume.pressure:
+                    logging.warning(f"磁盘可用空间不足 ({free / GB:.2f} GB < {low / GB:.2f} GB)，开始淘汰最旧的文件: {volume.path}")
+                volume.pressure = True
+                while free < high and len(victims) < EVICT_BATCH:
+                    entry = self._pop(volume)
+                    if entry is None:
+                        logging.warning(f"磁盘可用空间不足，但已没有可淘汰的文件: {volume.path}")
+                        break
+                    free += self._reclaimable(entry)
+                    victims.append((entry, 'File evicted due to low disk space'))
+        return victims
+
+    def _evict(self, victims: list):
+        for (_, task_id, path, size, _, file_path), reason in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"删除文件失败 {path}: {e}")
+                continue
+            if path != file_path:
+                # 失败任务的 .part：一并删除分块位图，任务保持失败状态
+                download_engine.discard(file_path)
+            else:
+                self.db.update_task_status(task_id, 'file_expired', error_msg=reason)
+            filename_registry.release(file_path)
+            self.evicted_files += 1
+            self.evicted_bytes += size
+            logging.info(f"🧹 已删除文件 ({reason}): {path}")
+        if victims:
+            self.db.flush_tasks()
+            # 唤醒因空间不足而等待的下载
+            disk_space.wake()
+
+    def run_once(self):
+        retention_days = self.db.get_int_setting('FILE_RETENTION_DAYS', 3)
+        low = self.db.get_float_setting('DISK_FREE_LOW_GB', 0, minimum=0) * GB
+        high = max(low, self.db.get_float_setting('DISK_FREE_HIGH_GB', 0, minimum=0) * GB)
+        victims = self._select(retention_days, low, high)
+        self._evict(victims)
+        return len(victims)
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"淘汰引擎加载文件列表失败: {e}")
+        while not self._stopping.is_set():
+            try:
+                # 单轮达到批量上限时说明还有待删除的文件，不等待直接继续
+                if self.run_once() >= EVICT_BATCH:
+                    continue
+            except Exception as e:
+                logging.error(f"淘汰引擎运行出错: {e}")
+            self._wakeup.wait(CHECK_INTERVAL)
+            self._wakeup.clear()
+
+
+eviction_engine = EvictionEngine()
+
+metrics.Gauge('tg_eviction_tracked_bytes', '淘汰引擎管理的已下载文件总大小', lambda: eviction_engine.tracked_bytes)
+metrics.Gauge('tg_evicted_files_total', '已被淘汰删除的文件数', lambda: eviction_engine.evicted_files, kind='counter')
+metrics.Gauge('tg_evicted_bytes_total', '已被淘汰删除的字节数', lambda: eviction_engine.evicted_bytes, kind='counter')
@@ -0,0 +1,101 @@
+import os
+import threading
+import collections
+
+import download_engine
+from database import db_manager
+
+
+class FilenameRegistry:
+    """
+    进程内的文件名占用表（按目录）。
+    目录首次使用时从文件系统（含 .part/.map 中间文件）和数据库中未完成任务的路径建立索引，
+    之后分配文件名只查内存：同名文件按 name_N 递增，并记住每个文件名已用到的序号，摊还 O(1)。
+    分配在同一把锁内完成，入队与下载同时进行的任务不会拿到同一个路径。
+    首次使用目录时会读数据库和扫描目录，事件循环中的调用方应先用 indexed() 判断，未建立索引时在线程中调用。
+    """
+
+    def __init__(self, db=db_manager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._dirs = {} # directory -> set(file_name)
+        self._counters = {} # (directory, stem, ext) -> 下一个尝试的序号
+        self._db_paths = None # directory -> set(file_name)，仅在首次使用时加载
+
+    def _load_db_paths(self):
+        # 写线程中尚未提交的任务路径都是本进程经占用表分配的，已在索引中，无需等待提交；
+        # 在锁内 flush 会让所有分配文件名的调用一起等待写线程
+        paths = collections.defaultdict(set)
+        for file_path in self.db.get_active_file_paths(flush=False):
+            directory, name = os.path.split(os.path.abspath(file_path))
+            paths[directory].add(name)
+        return paths
+
+    def _taken(self, directory: str) -> set:
+        taken = self._dirs.get(directory)
+        if taken is None:
+            if self._db_paths is None:
+                self._db_paths = self._load_db_paths()
+            taken = set(self._db_paths.pop(directory, ()))
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        name = entry.name
+                        for suffix in (download_engine.PART_SUFFIX, download_engine.MAP_SUFFIX):
+                            if name.endswith(suffix):
+                                name = name[:-len(suffix)]
+                                break
+                        taken.add(name)
+            except FileNotFoundError:
+                pass
+            self._dirs[directory] = taken
+        return taken
+
+    def indexed(self, directory: str) -> bool:
+        """目录是否已建立索引（之后的 reserve/claim 只查内存）"""
+        return os.path.abspath(directory) in self._dirs
+
+    @staticmethod
+    def _on_disk(path: str) -> bool:
+        # 索引建立后目录可能被外部写入，最终选中的文件名再确认一次
+        return os.path.exists(path) or os.path.exists(download_engine.part_path(path))
+
+    def reserve(self, directory: str, stem: str, ext: str) -> str:
+        """在 directory 中占用一个不重复的文件名（stem + ext 或 stem_N + ext）并返回"""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            taken = self._taken(directory)
+            name = f"{stem}{ext}"
+            key = (directory, stem, ext)
+            counter = self._counters.get(key, 1)
+            while name in taken or self._on_disk(os.path.join(directory, name)):
+                taken.add(name)
+                name = f"{stem}_{counter}{ext}"
+                counter += 1
+            if counter > 1:
+                self._counters[key] = counter
+            taken.add(name)
+            return name
+
+    def claim(self, file_path: str) -> bool:
+        """占用指定路径（如重命名目标），已被占用时返回 False"""
+        directory, name = os.path.split(os.path.abspath(file_path))
+        with self._lock:
+            taken = self._taken(directory)
+            if name in taken or self._on_disk(file_path):
+                return False
+            taken.add(name)
+            return True
+
+    def release(self, file_path: str):
+        """释放路径（任务失败、删除或文件被清理时调用）；文件仍在磁盘上时保留占用"""
+        if not file_path or self._on_disk(file_path):
+            return
+        directory, name = os.path.split(os.path.abspath(file_path))
+        with self._lock:
+            taken = self._dirs.get(directory)
+            if taken is not None:
+                taken.discard(name)
+
+
+filename_registry = FilenameRegistry()
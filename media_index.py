@@ -0,0 +1,117 @@
+import os
+import filecmp
+import logging
+import threading
+
+import download_engine
+from database import db_manager
+
+try:
+    import fcntl
+except ImportError: # 非 Linux 平台没有 reflink
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)，btrfs / xfs 等支持写时复制的文件系统可用
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        try: os.remove(dst)
+        except OSError: pass
+        return False
+
+
+def link_file(src: str, dst: str) -> bool:
+    """
+    让 dst 与 src 共享同一份数据：优先硬链接，不支持时尝试 reflink。
+    先在 .part 路径上创建再原子替换，中途退出不会留下半成品；两种方式都不可用时返回 False。
+    """
+    tmp = download_engine.part_path(dst)
+    try: os.remove(tmp)
+    except OSError: pass
+    try:
+        os.link(src, tmp)
+    except OSError:
+        if not _reflink(src, tmp):
+            return False
+    os.replace(tmp, dst)
+    download_engine.discard(dst)
+    return True
+
+
+class MediaIndex:
+    """
+    已下载媒体的指纹索引（表 media_files）。
+    同一视频被转发到多个频道时 Telegram 文档 ID 不变，新消息到达时按文档 ID + 大小查找磁盘上已有的文件；
+    重新上传的相同内容文档 ID 不同，下载完成后再按内容指纹（分块 CRC 组合）查找，逐字节确认后替换为链接。
+    以下方法均为阻塞 IO，应在线程中调用。
+    """
+
+    def __init__(self, db=db_manager):
+        self.db = db
+        # 同一内容的两个副本同时完成时会互相替换为对方的链接，结果仍是两份数据；内容去重串行执行
+        self._dedupe_lock = threading.Lock()
+
+    @staticmethod
+    def _usable(row, file_size: int) -> bool:
+        try:
+            return os.path.getsize(row['file_path']) == file_size
+        except (OSError, TypeError):
+            return False
+
+    def find(self, document_id: int, file_size: int):
+        """返回仍在磁盘上的同一文档的记录（含 file_path），没有时返回 None"""
+        for row in self.db.find_media_files(file_size, document_id=document_id):
+            if self._usable(row, file_size):
+                return row
+        return None
+
+    def record(self, task_id: int, document, file_size: int, content_hash: str = None):
+        self.db.add_media_file(task_id, getattr(document, 'id', None), getattr(document, 'access_hash', None),
+                               file_size, content_hash)
+
+    def dedupe_content(self, task_id: int, file_path: str, file_size: int, content_hash: str):
+        """
+        刚下载完成的文件（task_id 的记录已登记）与已有文件内容相同时，把它替换为指向已有文件的链接，
+        返回已有文件路径
+        """
+        with self._dedupe_lock:
+            return self._dedupe_content(task_id, file_path, file_size, content_hash)
+
+    def _dedupe_content(self, task_id: int, file_path: str, file_size: int, content_hash: str):
+        candidates = []
+        for row in self.db.find_media_files(file_size, content_hash=content_hash):
+            source = row['file_path']
+            # 跳过本任务自己的记录
+            if row['task_id'] == task_id or not self._usable(row, file_size):
+                continue
+            try:
+                if os.path.samefile(source, file_path):
+                    # 已经是同一个文件（此前已链接）
+                    return source
+                candidates.append((os.stat(source).st_nlink, source))
+            except OSError:
+                continue
+        # 优先链接到已被共享最多的文件，同一内容的多个副本收敛到同一份数据；其次取最新的
+        candidates.sort(key=lambda c: -c[0])
+        for _, source in candidates:
+            try:
+                # 指纹由 CRC32 组合而成，替换前逐字节确认
+                if not filecmp.cmp(source, file_path, shallow=False):
+                    continue
+            except OSError:
+                continue
+            if link_file(source, file_path):
+                logging.info(f"♻️ 内容与已有文件相同，已替换为链接: {os.path.basename(file_path)} -> {source}")
+                return source
+        return None
+
+
+media_index = MediaIndex()
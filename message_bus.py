@@ -0,0 +1,193 @@
+import time
+import asyncio
+import logging
+import collections
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+import metrics
+
+# 单个会话的限速：每秒补充的令牌数与桶容量（Telegram 对同一会话约 1 条/秒）
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+# 整个客户端的限速
+GLOBAL_RATE = 20.0
+GLOBAL_BURST = 20
+# FloodWait 之后额外等待的秒数
+FLOOD_WAIT_MARGIN = 1.0
+
+
+class TokenBucket:
+    """令牌桶：delay() 返回还需等待多少秒才能取到一个令牌"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    """通过消息总线异步发送的消息句柄，发送成功后 id 才可用"""
+
+    def __init__(self, chat_id, on_sent=None):
+        self.chat_id = chat_id
+        self.id = None
+        self.failed = False
+        self._on_sent = on_sent
+
+    def _resolve(self, message_id):
+        self.id = message_id
+        if self._on_sent:
+            try:
+                self._on_sent(self)
+            except Exception as e:
+                logging.error(f"消息发送回调出错: {e}")
+
+
+class MessageBus:
+    """
+    单个客户端的出站消息总线。
+    下载协程只把发送/编辑请求放进按会话分组的队列后立即返回，从不等待 Telegram；
+    由单个发送协程按会话令牌桶与全局令牌桶限速发出，遇到 FloodWait 整体暂停后重试。
+    同一条消息排队中的多次编辑只保留最新文本。
+    """
+
+    def __init__(self, client, name: str = ''):
+        self.client = client
+        self.name = name
+        self._chats = collections.OrderedDict() # chat_id -> OrderedDict[(kind, handle) -> payload]
+        self._buckets = {}
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(ops) for ops in self._chats.values())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 5.0):
+        """尽量在 timeout 内发完剩余消息，然后停止发送协程"""
+        if not self._task:
+            return
+        deadline = time.monotonic() + timeout
+        while self._chats and time.monotonic() < deadline and not self._task.done():
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def send(self, chat_id, text: str, reply_to=None, on_sent=None) -> OutboundMessage:
+        handle = OutboundMessage(chat_id, on_sent)
+        self._enqueue(chat_id, ('send', handle), (text, reply_to))
+        return handle
+
+    def reply(self, message, text: str, on_sent=None) -> OutboundMessage:
+        return self.send(message.chat_id, text, reply_to=message.id, on_sent=on_sent)
+
+    def edit(self, handle: OutboundMessage, text: str):
+        if handle is None or handle.failed:
+            return
+        self._enqueue(handle.chat_id, ('edit', handle), text)
+
+    def _enqueue(self, chat_id, key, payload, front: bool = False):
+        ops = self._chats.setdefault(chat_id, collections.OrderedDict())
+        if key in ops and front:
+            # 重试期间已有更新的编辑排队，保留新文本
+            return
+        # 已在排队的编辑保持原位置，只替换文本
+        ops[key] = payload
+        if front:
+            ops.move_to_end(key, last=False)
+        self._wakeup.set()
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST)
+        return bucket
+
+    def _next_chat(self, now: float):
+        """按轮转顺序返回第一个有令牌的会话；都没有时返回 (None, 最短等待时间)"""
+        shortest = None
+        for chat_id in self._chats:
+            wait = self._bucket(chat_id).delay(now)
+            if wait <= 0:
+                return chat_id, 0.0
+            shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+    async def _wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._chats:
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            wait = self._global.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            chat_id, wait = self._next_chat(now)
+            if chat_id is None:
+                # 新会话的消息可能不受限，入队时提前唤醒
+                await self._wait(wait)
+                continue
+            await self._dispatch(chat_id)
+
+    async def _dispatch(self, chat_id):
+        ops = self._chats[chat_id]
+        key, payload = ops.popitem(last=False)
+        if ops:
+            self._chats.move_to_end(chat_id)
+        else:
+            del self._chats[chat_id]
+        self._bucket(chat_id).take()
+        self._global.take()
+
+        kind, handle = key
+        started = time.monotonic()
+        try:
+            if kind == 'send':
+                text, reply_to = payload
+                message = await self.client.send_message(chat_id, text, reply_to=reply_to)
+                metrics.TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, 'send')
+                handle._resolve(message.id)
+            elif handle.id is not None:
+                await self.client.edit_message(chat_id, handle.id, payload)
+                metrics.TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, 'edit')
+        except FloodWaitError as e:
+            logging.warning(f"MessageBus [{self.name}] 触发 FloodWait，暂停发送 {e.seconds} 秒")
+            metrics.FLOOD_WAITS.inc(1, self.name)
+            metrics.FLOOD_WAIT_SECONDS.inc(e.seconds, self.name)
+            self._paused_until = time.monotonic() + e.seconds + FLOOD_WAIT_MARGIN
+            self._enqueue(chat_id, key, payload, front=True)
+        except MessageNotModifiedError:
+            pass
+        except Exception as e:
+            if kind == 'send':
+                handle.failed = True
+                logging.warning(f"MessageBus [{self.name}] 发送消息到 [{chat_id}] 失败: {e}")
+            else:
+                logging.debug(f"MessageBus [{self.name}] 编辑消息失败: {e}")
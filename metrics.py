@@ -0,0 +1,198 @@
+import bisect
+import threading
+
+# Prometheus 文本格式 (0.0.4) 的最小实现，不依赖 prometheus_client。
+# 计数器与直方图按线程分片：每个线程只写自己的字典，热路径上不加锁；
+# 抓取时汇总所有分片，已退出线程的分片合并后移除。
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        with _registry_lock:
+            _registry.append(self)
+
+    def samples(self):
+        """返回 [(后缀, 标签值元组, 额外标签, 值)]"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class _Sharded(_Metric):
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self._local = threading.local()
+        self._shards = [] # [(thread, values)]
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def _prune(self):
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                # 线程已退出，不会再写入该分片
+                for key, value in values.items():
+                    self._retired[key] = self._merge(self._retired.get(key), value)
+        self._shards = alive
+
+    def _merge(self, total, value):
+        raise NotImplementedError
+
+    def _collect(self) -> dict:
+        with self._lock:
+            self._prune()
+            merged = {key: self._merge(None, value) for key, value in self._retired.items()}
+            for _, values in self._shards:
+                # dict.copy() 在 GIL 下是原子的，写入线程不需要为读取方加锁
+                for key, value in values.copy().items():
+                    merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def _merge(self, total, value):
+        return (total or 0) + value
+
+    def samples(self):
+        return [('', key, '', value) for key, value in sorted(self._collect().items())]
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        values = self._shard()
+        state = values.get(labels)
+        if state is None:
+            # [各区间计数（最后一个为 +Inf）..., 总和, 次数]
+            state = values[labels] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def _merge(self, total, value):
+        value = list(value)
+        if total is None:
+            return value
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self):
+        result = []
+        for key, state in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                result.append(('_bucket', key, f'le="{_format_value(float(bound))}"', cumulative))
+            result.append(('_sum', key, '', state[-2]))
+            result.append(('_count', key, '', state[-1]))
+        return result
+
+
+class Gauge(_Metric):
+    """
+    抓取时才求值的指标：func 返回数值，或 {标签值元组: 数值}。
+    数据本来就保存在内存中的状态（队列长度、槽位、磁盘预留等）用它暴露，热路径上没有任何开销。
+    kind 为 counter 时用于暴露其他模块自行累计的计数。
+    """
+
+    def __init__(self, name: str, help: str, func, labels=(), kind: str = 'gauge'):
+        super().__init__(name, help, labels)
+        self.func = func
+        self.kind = kind
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [('', key, '', v) for key, v in sorted(value.items())]
+        return [('', (), '', value)]
+
+
+def render() -> str:
+    """所有已注册指标的文本格式输出；单个指标求值失败时跳过，不影响其他指标"""
+    with _registry_lock:
+        metrics = list(_registry)
+    blocks = []
+    for metric in metrics:
+        try:
+            blocks.append(metric.render())
+        except Exception as e:
+            blocks.append(f"# {metric.name} 采集失败: {_escape(e)}")
+    return '\n'.join(blocks) + '\n'
+
+
+# --- 下载 ---
+DOWNLOAD_BYTES = Counter('tg_download_bytes_total', '已下载的字节数', ('account', 'channel'))
+DOWNLOADS = Counter('tg_downloads_total', '结束的下载任务数', ('account', 'result'))
+QUEUE_WAIT = Histogram('tg_queue_wait_seconds', '任务在账号队列中的等待时间', ('account',),
+                       buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200))
+SLOT_WAIT = Histogram('tg_slot_wait_seconds', '任务等待全局下载槽位的时间', ('account',),
+                      buckets=(.01, .1, 1, 5, 15, 30, 60, 300, 900, 3600))
+
+# --- Telegram 消息 ---
+TELEGRAM_REQUEST_SECONDS = Histogram('tg_telegram_request_seconds', 'Telegram 发送/编辑消息的耗时', ('op',))
+FLOOD_WAITS = Counter('tg_flood_waits_total', '触发 FloodWait 的次数', ('bus',))
+FLOOD_WAIT_SECONDS = Counter('tg_flood_wait_seconds_total', '因 FloodWait 暂停的秒数', ('bus',))
+
+# --- 数据库 ---
+DB_QUERY_SECONDS = Histogram('tg_db_query_seconds', 'DatabaseManager 各方法的耗时', ('method',),
+                             buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+DB_WRITE_BATCH_SECONDS = Histogram('tg_db_task_batch_seconds', '任务写入合并批次的提交耗时',
+                                   buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+
+# --- 通知 ---
+NOTIFY_SECONDS = Histogram('tg_notify_seconds', '通知推送耗时（含重试）', ('type',))
+NOTIFY_FAILURES = Counter('tg_notify_failures_total', '最终推送失败的通知数', ('type',))
+NOTIFY_DROPPED = Counter('tg_notify_dropped_total', '队列已满被丢弃的通知数')
@@ -0,0 +1,258 @@
+import logging
+
+# 数据库结构版本记录在 PRAGMA user_version 中，每个迁移只会执行一次。
+# 新增迁移时追加到 MIGRATIONS 末尾，不要修改已发布的迁移。
+
+
+def _columns(conn, table: str) -> list:
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_columns(conn, table: str, columns: dict):
+    existing = _columns(conn, table)
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _migrate_legacy_accounts(conn):
+    """旧版 accounts 表把频道以逗号分隔存放在 channel_id 列中，拆分到 channels 表"""
+    old_columns = _columns(conn, 'accounts')
+    if 'channel_id' not in old_columns or 'created_at' in old_columns:
+        return
+    old_accounts = conn.execute("SELECT * FROM accounts").fetchall()
+    conn.execute("ALTER TABLE accounts RENAME TO accounts_old")
+    conn.execute('''
+        CREATE TABLE accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            api_id INTEGER,
+            api_hash TEXT,
+            bot_token TEXT,
+            session_name TEXT,
+            created_at TEXT
+        )
+    ''')
+    for old_acc in old_accounts:
+        conn.execute('''
+            INSERT INTO accounts (id, name, api_id, api_hash, bot_token, session_name, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+        ''', (old_acc[0], old_acc[1], old_acc[2], old_acc[3], old_acc[4], old_acc[6]))
+
+        if old_acc[5]: # channel_id 字段
+            for ch_id in str(old_acc[5]).split(','):
+                ch_id = ch_id.strip()
+                if ch_id:
+                    conn.execute('''
+                        INSERT INTO channels (account_id, channel_id, channel_name, enabled, status)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (old_acc[0], ch_id, ch_id, old_acc[7] if len(old_acc) > 7 else 1, 'stopped'))
+    conn.execute("DROP TABLE accounts_old")
+    logging.info("已将旧版账号数据迁移到新结构")
+
+
+def _v1_baseline(conn):
+    """基础结构。引入版本号之前的数据库可能处于任意中间状态，这里的每一步都是幂等的"""
+    # 设置表 (全局通用)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    # 用户表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT
+        )
+    ''')
+    # Telegram 账号表（仅存储认证信息）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            api_id INTEGER,
+            api_hash TEXT,
+            bot_token TEXT,
+            session_name TEXT,
+            created_at TEXT
+        )
+    ''')
+    # 频道监听表（每个频道一条记录）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER,
+            channel_id TEXT,
+            channel_name TEXT,
+            enabled INTEGER DEFAULT 1,
+            status TEXT DEFAULT 'stopped',
+            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE CASCADE
+        )
+    ''')
+    # 通知配置表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            type TEXT, -- e.g. 'bark'
+            config TEXT, -- JSON string
+            enabled INTEGER DEFAULT 1
+        )
+    ''')
+    # 下载任务历史表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER,
+            message_id INTEGER,
+            file_name TEXT,
+            file_size REAL,
+            status TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            error_msg TEXT
+        )
+    ''')
+    _add_columns(conn, 'tasks', {
+        'account_id': 'INTEGER',
+        'file_path': 'TEXT',
+        'channel_id': 'INTEGER',
+        'source_message_id': 'INTEGER',
+        'source_channel_id': 'INTEGER',
+        'priority': 'INTEGER DEFAULT 0',
+    })
+    _add_columns(conn, 'channels', {
+        'custom_path': 'TEXT',
+        'priority': 'INTEGER DEFAULT 0',
+        'weight': 'INTEGER DEFAULT 1',
+    })
+    _migrate_legacy_accounts(conn)
+
+
+def _v2_task_indexes(conn):
+    """任务表索引：状态统计、按账号恢复、过期清理，以及只覆盖活跃任务的部分索引"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_id ON tasks (status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_account_status ON tasks (account_id, status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_end_time ON tasks (status, end_time)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tasks_active ON tasks (id)
+        WHERE status IN ('downloading', 'waiting')
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tasks_downloading ON tasks (id)
+        WHERE status = 'downloading'
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channels_account ON channels (account_id)")
+    conn.execute("ANALYZE")
+
+
+def fts_available(conn) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+    ).fetchone() is not None
+
+
+def _v3_task_search(conn):
+    """任务历史筛选索引与全文检索（文件名 + 消息文本）"""
+    _add_columns(conn, 'tasks', {'caption': 'TEXT'})
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_account_id ON tasks (account_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_channel_id ON tasks (channel_id, id)")
+    # trigram 分词支持中文子串匹配；SQLite 未编译 FTS5 时跳过，检索退化为 LIKE
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                file_name, caption, content='tasks', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except Exception as e:
+        logging.warning(f"当前 SQLite 不支持 FTS5 trigram，任务搜索将使用 LIKE: {e}")
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, file_name, caption) VALUES (new.id, new.file_name, new.caption);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, file_name, caption) VALUES ('delete', old.id, old.file_name, old.caption);
+        END
+    """)
+    # 只在文件名或文本变化时更新索引，状态更新不受影响
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF file_name, caption ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, file_name, caption) VALUES ('delete', old.id, old.file_name, old.caption);
+            INSERT INTO tasks_fts (rowid, file_name, caption) VALUES (new.id, new.file_name, new.caption);
+        END
+    """)
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+
+def _v4_media_index(conn):
+    """已下载媒体的指纹索引（Telegram 文档 ID、大小、内容哈希），用于识别重复转发的视频"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_files (
+            task_id INTEGER PRIMARY KEY,
+            document_id INTEGER,
+            access_hash INTEGER,
+            file_size INTEGER,
+            content_hash TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_document ON media_files (document_id, file_size)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_content ON media_files (content_hash, file_size)")
+    # 任务记录删除时同步删除指纹
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS media_files_task_delete AFTER DELETE ON tasks BEGIN
+            DELETE FROM media_files WHERE task_id = old.id;
+        END
+    """)
+    # 频道的重复媒体处理策略：link 创建硬链接跳过下载，off 总是重新下载
+    _add_columns(conn, 'channels', {'dedup_policy': "TEXT DEFAULT 'link'"})
+
+
+def _v5_task_timings(conn):
+    """任务各阶段耗时（JSON，单位秒）、平均下载速度（字节/秒）与断点续传次数"""
+    _add_columns(conn, 'tasks', {
+        'timings': 'TEXT',
+        'avg_speed': 'REAL',
+        'resume_count': 'INTEGER DEFAULT 0'
+    })
+
+
+MIGRATIONS = [
+    (1, '基础表结构', _v1_baseline),
+    (2, '任务表索引', _v2_task_indexes),
+    (3, '任务历史筛选与全文检索', _v3_task_search),
+    (4, '媒体指纹索引', _v4_media_index),
+    (5, '任务耗时分解', _v5_task_timings),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn) -> int:
+    """把数据库升级到最新版本，每个迁移在独立事务中执行，返回升级后的版本号"""
+    for version, description, func in MIGRATIONS:
+        if version <= get_version(conn):
+            continue
+        # IMMEDIATE 事务保证多个进程同时启动时只有一个执行迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_version(conn):
+                conn.rollback()
+                continue
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"数据库迁移 v{version} ({description}) 失败: {e}")
+            raise
+        logging.info(f"数据库已迁移到 v{version}: {description}")
+    return get_version(conn)
@@ -81,7 +81,10 @@ Page({
         channel_id: '',
         channel_name: '',
         enabled: 1,
-        custom_path: ''
+        custom_path: '',
+        priority: 0,
+        weight: 1,
+        dedup_policy: 'link'
       }
     })
   },
@@ -100,7 +103,10 @@ Page({
         channel_id: channel.channel_id,
         channel_name: channel.channel_name || '',
         enabled: channel.enabled,
-        custom_path: channel.custom_path || ''
+        custom_path: channel.custom_path || '',
+        priority: channel.priority || 0,
+        weight: channel.weight || 1,
+        dedup_policy: channel.dedup_policy || 'link'
       }
     })
   },
@@ -143,12 +149,30 @@ Page({
     })
   },
 
+  onPriorityInput(e) {
+    this.setData({
+      'formData.priority': e.detail.value
+    })
+  },
+
+  onWeightInput(e) {
+    this.setData({
+      'formData.weight': e.detail.value
+    })
+  },
+
   toggleEnabled() {
     this.setData({
       'formData.enabled': this.data.formData.enabled ? 0 : 1
     })
   },
 
+  toggleDedup() {
+    this.setData({
+      'formData.dedup_policy': this.data.formData.dedup_policy === 'off' ? 'link' : 'off'
+    })
+  },
+
   saveChannel() {
     const { account_id, channel_id } = this.data.formData
 
@@ -6,7 +6,10 @@ Page({
     currentPage: 1,
     pageSize: 20,
     totalCount: 0,
-    totalPages: 0
+    totalPages: 0,
+    // 游标分页：cursors[i] 为第 i + 1 页的起始游标
+    cursors: [null],
+    hasMore: false
   },
 
   onLoad() {
@@ -24,17 +27,20 @@ Page({
 
   loadTasks() {
     const app = getApp()
-    const { currentPage, pageSize } = this.data
+    const { currentPage, pageSize, cursors } = this.data
+    const cursor = cursors[currentPage - 1]
 
     this.setData({
       loading: true
     })
 
-    app.request(`/tasks?page=${currentPage}&limit=${pageSize}`, 'GET')
+    app.request(`/tasks?limit=${pageSize}${cursor ? `&cursor=${cursor}` : ''}`, 'GET')
       .then(res => {
         if (res.code === 200) {
           const totalCount = res.count
-          const totalPages = Math.ceil(totalCount / pageSize)
+          const totalPages = Math.max(currentPage, Math.ceil(totalCount / pageSize))
+          const nextCursors = cursors.slice(0, currentPage)
+          nextCursors.push(res.next_cursor)
 
           // 处理图标显示
           const tasks = res.data.map(task => {
@@ -62,6 +68,8 @@ Page({
             tasks: tasks,
             totalCount: totalCount,
             totalPages: totalPages,
+            cursors: nextCursors,
+            hasMore: !!res.next_cursor,
             loading: false
           })
         }
@@ -84,7 +92,7 @@ Page({
   },
 
   nextPage() {
-    if (this.data.currentPage < this.data.totalPages) {
+    if (this.data.hasMore) {
       this.setData({
         currentPage: this.data.currentPage + 1
       })
@@ -156,7 +164,8 @@ Page({
         wx.hideLoading()
         if (res.code === 200) {
           this.setData({
-            currentPage: 1
+            currentPage: 1,
+            cursors: [null]
           })
           this.loadTasks()
         } else {
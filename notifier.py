@@ -0,0 +1,166 @@
+import time
+import queue
+import logging
+import threading
+from urllib.parse import quote
+
+import requests
+
+from database import db_manager
+import metrics
+
+QUEUE_SIZE = 1000
+REQUEST_TIMEOUT = 10
+# 失败重试次数与首次退避时间（秒，逐次翻倍），4xx 错误不重试
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+# 摘要模式下单条推送最多列出的事件数
+DIGEST_MAX_LINES = 20
+BARK_TITLE = 'TG-Downloader'
+
+_STOP = object()
+
+
+class NotificationDispatcher:
+    """
+    常驻通知分发器。
+    调用方只把事件放进有界队列立即返回（队列满时丢弃并记录日志），由单个后台线程复用
+    HTTP 连接池推送到各通知通道，失败按指数退避重试。
+    通道列表缓存在内存中，通知配置变更（db.notifications_version 递增）后才重新读取。
+    设置 NOTIFY_DIGEST_SECONDS > 0 时开启摘要模式：窗口内的突发事件合并为一条推送。
+    """
+
+    def __init__(self, db=db_manager, maxsize: int = QUEUE_SIZE):
+        self.db = db
+        self._queue = queue.Queue(maxsize)
+        self._session = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._channels = None
+        self._channels_version = None
+        self._senders = {'bark': self._send_bark}
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._session = requests.Session()
+            self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """发送完已排队的事件后停止（不再等待失败重试）"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if not thread:
+            return
+        self._stopping.set()
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def notify(self, content: str) -> bool:
+        """非阻塞投递一条通知，队列已满时返回 False"""
+        if not self._thread:
+            self.start()
+        try:
+            self._queue.put_nowait(content)
+            return True
+        except queue.Full:
+            logging.warning(f"通知队列已满，丢弃通知: {content}")
+            metrics.NOTIFY_DROPPED.inc()
+            return False
+
+    def join(self):
+        """等待已投递的事件全部处理完毕"""
+        self._queue.join()
+
+    def get_channels(self) -> list:
+        version = self.db.notifications_version
+        if self._channels is None or version != self._channels_version:
+            self._channels_version = version
+            self._channels = [n for n in self.db.get_notifications() if n['enabled']]
+        return self._channels
+
+    def _digest_seconds(self) -> float:
+        return self.db.get_float_setting('NOTIFY_DIGEST_SECONDS', 0.0, minimum=0.0)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            window = self._digest_seconds()
+            deadline = time.monotonic() + window
+            while window > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._deliver(merge_digest(batch))
+            except Exception as e:
+                logging.error(f"通知分发出错: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        self._session.close()
+
+    def _deliver(self, content: str):
+        for n in self.get_channels():
+            sender = self._senders.get(n['type'])
+            if not sender:
+                continue
+            delay = RETRY_BACKOFF
+            started = time.monotonic()
+            for attempt in range(1, MAX_RETRIES + 1):
+                try:
+                    sender(n['config'], content)
+                    break
+                except Exception as e:
+                    status = getattr(getattr(e, 'response', None), 'status_code', None)
+                    retryable = status is None or status >= 500 or status == 429
+                    if not retryable or attempt == MAX_RETRIES:
+                        logging.error(f"发送通知 [{n['name']}] 失败: {e}")
+                        metrics.NOTIFY_FAILURES.inc(1, n['type'])
+                        break
+                    logging.warning(f"发送通知 [{n['name']}] 失败，{delay:.0f} 秒后重试 ({attempt}/{MAX_RETRIES}): {e}")
+                    if self._stopping.wait(delay):
+                        metrics.NOTIFY_FAILURES.inc(1, n['type'])
+                        return
+                    delay *= 2
+            metrics.NOTIFY_SECONDS.observe(time.monotonic() - started, n['type'])
+
+    def _send_bark(self, config: dict, content: str):
+        url = config.get('barkUrl')
+        if not url:
+            return
+        full_url = f"{url.rstrip('/')}/{quote(BARK_TITLE)}/{quote(content, safe='')}"
+        self._session.get(full_url, timeout=REQUEST_TIMEOUT).raise_for_status()
+
+
+def merge_digest(batch: list) -> str:
+    """把一批事件合并为一条推送内容"""
+    if len(batch) == 1:
+        return batch[0]
+    lines = batch[:DIGEST_MAX_LINES]
+    if len(batch) > DIGEST_MAX_LINES:
+        lines.append(f"... 另有 {len(batch) - DIGEST_MAX_LINES} 条")
+    return f"共 {len(batch)} 条通知\n" + "\n".join(lines)
+
+
+notifier = NotificationDispatcher()
+
+metrics.Gauge('tg_notify_queue_depth', '等待推送的通知数', lambda: notifier._queue.qsize())
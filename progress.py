@@ -0,0 +1,134 @@
+import math
+import time
+import asyncio
+import logging
+
+# 采样周期（秒）：每个周期统一计算所有下载的速度与 ETA
+SAMPLE_INTERVAL = 1.0
+# Telegram 状态消息刷新周期（秒）以及每个周期每个账号最多编辑的消息数
+EDIT_INTERVAL = 3.0
+MAX_EDITS_PER_TICK = 3
+# EWMA 时间常数（秒），越大速度曲线越平滑
+SPEED_TAU = 5.0
+
+# { account_id: { task_id: { percentage, downloaded_mb, total_mb, speed, eta, ... } } }
+progress_status = {}
+
+
+class ProgressTracker:
+    """
+    下载进度聚合器。
+    下载协程只调用 update() 记录字节数（无计算、无 IO），
+    由周期性的 tick 统一采样计算瞬时 EWMA 速度与 ETA，并合并刷新 Telegram 状态消息，
+    这样 CPU 与消息编辑量不会随并发数线性增长。/api/status 读取同一份数据。
+    """
+
+    def __init__(self, store: dict):
+        self.store = store
+
+    def start(self, account_id, task_id, file_name: str, total: int, status_message=None, downloaded: int = 0):
+        now = time.monotonic()
+        self.store.setdefault(account_id, {})[task_id] = {
+            'file_name': file_name,
+            'status_message': status_message,
+            'bytes': downloaded,
+            'total_bytes': total,
+            'start_time': time.time(),
+            'percentage': round(downloaded * 100 / total, 1) if total > 0 else 0,
+            'downloaded_mb': round(downloaded / 1024 / 1024, 2),
+            'total_mb': round(total / 1024 / 1024, 2),
+            'speed': "0.00 MB/s",
+            'speed_bps': 0.0,
+            'eta': None,
+            '_sample_time': now,
+            '_sample_bytes': downloaded,
+            '_last_edit': 0,
+            '_last_text': None
+        }
+
+    def update(self, account_id, task_id, current: int):
+        """下载热路径：仅记录当前字节数"""
+        entry = self.store.get(account_id, {}).get(task_id)
+        if entry is not None:
+            entry['bytes'] = current
+
+    def finish(self, account_id, task_id):
+        self.store.get(account_id, {}).pop(task_id, None)
+
+    def get(self, account_id, task_id) -> dict:
+        return self.store.get(account_id, {}).get(task_id, {})
+
+    def sample(self, account_id, now: float = None):
+        """计算指定账号所有下载的 EWMA 速度、百分比与 ETA"""
+        now = now or time.monotonic()
+        for entry in list(self.store.get(account_id, {}).values()):
+            dt = now - entry['_sample_time']
+            if dt <= 0:
+                continue
+            current = entry['bytes']
+            instant = max(0, current - entry['_sample_bytes']) / dt
+            # 按实际采样间隔折算平滑系数，tick 抖动时曲线依然稳定
+            alpha = 1 - math.exp(-dt / SPEED_TAU)
+            speed = instant if entry['speed_bps'] == 0 else alpha * instant + (1 - alpha) * entry['speed_bps']
+            total = entry['total_bytes'] or current
+
+            entry['_sample_time'] = now
+            entry['_sample_bytes'] = current
+            entry['speed_bps'] = speed
+            entry['speed'] = f"{speed / 1024 / 1024:.2f} MB/s"
+            entry['percentage'] = round(current * 100 / total, 1) if total > 0 else 0
+            entry['downloaded_mb'] = round(current / 1024 / 1024, 2)
+            entry['total_mb'] = round(total / 1024 / 1024, 2)
+            entry['eta'] = int((total - current) / speed) if speed > 0 and total >= current else None
+
+    def pending_edits(self, account_id, now: float = None):
+        """挑选本轮需要刷新的状态消息：文本有变化的条目中最久未刷新的若干个"""
+        now = now or time.monotonic()
+        changed = []
+        for task_id, entry in list(self.store.get(account_id, {}).items()):
+            if not entry.get('status_message') or now - entry['_last_edit'] < EDIT_INTERVAL:
+                continue
+            text = render_progress_text(entry)
+            if text != entry['_last_text']:
+                changed.append((entry['_last_edit'], task_id, entry, text))
+        changed.sort(key=lambda x: x[0])
+        result = []
+        for _, task_id, entry, text in changed[:MAX_EDITS_PER_TICK]:
+            entry['_last_edit'] = now
+            entry['_last_text'] = text
+            result.append((entry['status_message'], text))
+        return result
+
+
+def format_eta(seconds) -> str:
+    if seconds is None: return "--"
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def render_progress_text(entry: dict) -> str:
+    percentage = entry['percentage']
+    filled_blocks = int(round(percentage / 10))
+    progress_bar = '█' * filled_blocks + '░' * (10 - filled_blocks)
+    return (
+        f"**正在下载**: `{entry['file_name']}`\n\n"
+        f"**进度**: `[{progress_bar}] {percentage:.1f}%`\n\n"
+        f"**大小**: `{entry['downloaded_mb']:.2f}MB / {entry['total_mb']:.2f}MB`\n"
+        f"**速度**: `{entry['speed']}`  **剩余**: `{format_eta(entry['eta'])}`"
+    )
+
+
+progress_tracker = ProgressTracker(progress_status)
+
+
+async def progress_ticker(bus, account_id):
+    """账号级的统一进度 tick：采样所有下载，并把状态消息编辑交给消息总线"""
+    while True:
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        try:
+            progress_tracker.sample(account_id)
+            for status_message, text in progress_tracker.pending_edits(account_id):
+                bus.edit(status_message, text)
+        except Exception as e:
+            logging.error(f"进度刷新出错: {e}")
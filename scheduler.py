@@ -0,0 +1,376 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextlib
+import collections
+
+import metrics
+
+
+def call_soon_in(loop, callback, *args):
+    """
+    在 loop 中调度回调。调用方就在该循环中时（共享事件循环模式下的常见情况）直接 call_soon，
+    省去跨线程唤醒的自管道写入；否则使用 call_soon_threadsafe（循环已关闭时抛出 RuntimeError）。
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        loop.call_soon(callback, *args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+
+class DownloadSlots:
+    """
+    全局下载槽位（跨线程、跨事件循环共享）。
+    每个账号 Bot 运行在独立线程的事件循环中，这里用线程锁保护计数，
+    并通过 call_soon_threadsafe 唤醒其他循环里的等待者，下载结束后立即让出槽位，无需轮询数据库。
+    等待者按 key（账号）分组轮转唤醒，避免单个账号的大量 worker 独占槽位。
+    """
+
+    def __init__(self, limit: int = 3):
+        self._lock = threading.Lock()
+        self._limit = max(1, int(limit))
+        self._active = 0
+        self._waiters = collections.OrderedDict() # key -> deque[(loop, future)]
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._waiters.values())
+
+    def set_limit(self, limit: int):
+        """调整全局并发上限，调大时立即唤醒等待者；调小时已占用的槽位自然释放后生效"""
+        with self._lock:
+            self._limit = max(1, int(limit))
+            self._wake_locked()
+
+    async def acquire(self, key=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self._limit and not self._waiters:
+                self._active += 1
+                return
+            fut = loop.create_future()
+            waiter = (loop, fut)
+            self._waiters.setdefault(key, collections.deque()).append(waiter)
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                queue = self._waiters.get(key)
+                try:
+                    queue.remove(waiter)
+                    granted = False
+                    if not queue:
+                        del self._waiters[key]
+                except (AttributeError, ValueError):
+                    granted = True
+            # 槽位已分配但任务被取消：若 future 已有结果需要在这里归还，
+            # 否则由 _resolve 在看到 future 被取消时归还
+            if granted and fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            self._wake_locked()
+
+    def _wake_locked(self):
+        while self._waiters and self._active < self._limit:
+            key, queue = next(iter(self._waiters.items()))
+            loop, fut = queue.popleft()
+            # 轮到的账号移到末尾，下一次唤醒其他账号
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            self._active += 1
+            try:
+                call_soon_in(loop, self._resolve, fut)
+            except RuntimeError:
+                # 等待者所在的事件循环已关闭
+                self._active -= 1
+
+    def _resolve(self, fut):
+        if fut.cancelled():
+            self.release()
+        elif not fut.done():
+            fut.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key=None):
+        """占用一个槽位，返回 SlotLease，可在等待其他资源期间临时让出"""
+        await self.acquire(key)
+        lease = SlotLease(self, key)
+        try:
+            yield lease
+        finally:
+            if lease.held:
+                self.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SlotLease:
+    """DownloadSlots.slot() 持有的槽位"""
+
+    def __init__(self, slots: DownloadSlots, key=None):
+        self.slots = slots
+        self.key = key
+        self.held = True
+
+    @contextlib.asynccontextmanager
+    async def suspend(self):
+        """
+        临时让出槽位（例如等待磁盘空间），让其他账号的任务先下载；正常退出时重新排队获取槽位。
+        内部抛出异常或重新获取时被取消，则不再持有槽位，slot() 退出时不会重复归还。
+        """
+        self.slots.release()
+        self.held = False
+        yield
+        await self.slots.acquire(self.key)
+        self.held = True
+
+
+download_slots = DownloadSlots()
+
+metrics.Gauge('tg_download_slots_active', '已占用的全局下载槽位', lambda: download_slots.active)
+metrics.Gauge('tg_download_slots_limit', '全局下载槽位上限', lambda: download_slots.limit)
+metrics.Gauge('tg_download_slots_waiting', '等待全局下载槽位的任务数', lambda: download_slots.waiting)
+
+
+class WorkerPool:
+    """
+    单个账号的下载协程池。
+    多个 worker 共同消费同一个队列，池大小可在运行时调整：
+    调小时空闲的 worker 立即退出，忙碌的 worker 处理完当前任务后退出。
+    """
+
+    def __init__(self, queue, handler, name: str = ''):
+        self.name = name
+        self._queue = queue
+        self._handler = handler
+        self._loop = None
+        self._target = 0
+        self._workers = {} # index -> task
+        self._idle = set()
+
+    @property
+    def size(self) -> int:
+        return self._target
+
+    @property
+    def busy(self) -> int:
+        return len(self._workers) - len(self._idle)
+
+    def start(self, size: int):
+        self._loop = asyncio.get_running_loop()
+        self.resize(size)
+
+    def resize(self, size: int):
+        """调整 worker 数量，必须在池所在的事件循环中调用"""
+        self._target = max(1, int(size))
+        for index in range(self._target):
+            if index not in self._workers:
+                self._workers[index] = self._loop.create_task(self._run(index))
+        for index, task in list(self._workers.items()):
+            if index >= self._target and index in self._idle:
+                del self._workers[index]
+                task.cancel()
+
+    def resize_threadsafe(self, size: int):
+        """供其他线程（如 Web 设置接口）调用"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.resize, size)
+
+    async def stop(self):
+        """取消所有 worker 并等待其退出"""
+        self._target = 0
+        tasks = list(self._workers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        self._idle.clear()
+
+    async def _run(self, index: int):
+        try:
+            while index < self._target:
+                self._idle.add(index)
+                try:
+                    item = await self._queue.get()
+                finally:
+                    self._idle.discard(index)
+                try:
+                    await self._handler(item)
+                except Exception as e:
+                    logging.error(f"Worker [{self.name}#{index}] Error: {e}")
+                finally:
+                    self._queue.task_done()
+        finally:
+            if self._workers.get(index) is asyncio.current_task():
+                del self._workers[index]
+
+
+class FairQueue:
+    """
+    下载队列调度器，替代 FIFO 的 asyncio.Queue（接口兼容 put/get/task_done）。
+    - 按频道分组，频道优先级 + 任务优先级高者先出
+    - 同优先级的频道之间按权重做平滑加权轮转 (Smooth Weighted Round Robin)，避免单频道刷屏饿死其他频道
+    - 频道内部按任务优先级排序，可选“小文件优先”，否则按入队顺序
+    on_dequeue: 可选回调，任务出队时以 (排队时长秒数, task_id) 调用
+    """
+
+    def __init__(self, smallest_first: bool = False, on_dequeue=None):
+        self.smallest_first = smallest_first
+        self.on_dequeue = on_dequeue
+        self._channels = {} # channel_key -> {'heap', 'weight', 'priority', 'current'}
+        self._getters = collections.deque()
+        self._seq = itertools.count()
+        self._unfinished = 0
+        self._size = 0
+        self.loop = None
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def _sort_key(self, entry):
+        if not self.smallest_first:
+            size = 0
+        elif entry['size'] > 0:
+            size = entry['size']
+        else:
+            # 未知大小的文件在“小文件优先”模式下排在最后
+            size = float('inf')
+        return (-entry['priority'], size, entry['seq'])
+
+    def put_nowait(self, item, channel: dict = None, priority: int = 0, size: int = 0, task_id: int = None):
+        """channel 为频道记录（含 id / priority / weight），为空时归入默认分组"""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        key = channel['id'] if channel else None
+        group = self._channels.get(key)
+        if group is None:
+            group = self._channels[key] = {'heap': [], 'weight': 1, 'priority': 0, 'current': 0}
+        if channel:
+            group['weight'] = max(1, int(channel.get('weight') or 1))
+            group['priority'] = int(channel.get('priority') or 0)
+
+        entry = {'item': item, 'priority': int(priority or 0), 'size': size or 0, 'seq': next(self._seq), 'task_id': task_id,
+                 'enqueued': time.monotonic()}
+        heapq.heappush(group['heap'], (self._sort_key(entry), entry['seq'], entry))
+        self._size += 1
+        self._unfinished += 1
+        self._wakeup_next()
+
+    async def put(self, item, **kwargs):
+        self.put_nowait(item, **kwargs)
+
+    def get_nowait(self):
+        if self._size == 0:
+            raise asyncio.QueueEmpty
+        group = self._select_group()
+        _, _, entry = heapq.heappop(group['heap'])
+        self._size -= 1
+        if self.on_dequeue:
+            self.on_dequeue(time.monotonic() - entry['enqueued'], entry['task_id'])
+        return entry['item']
+
+    async def get(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        while self._size == 0:
+            getter = self.loop.create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                # 被唤醒后又取消，把唤醒机会让给下一个等待者
+                if self._size > 0:
+                    self._wakeup_next()
+                raise
+        return self.get_nowait()
+
+    def task_done(self):
+        if self._unfinished > 0:
+            self._unfinished -= 1
+
+    def reprioritize(self, task_id: int, priority: int) -> bool:
+        """手动调整排队中任务的优先级，找到并更新返回 True"""
+        for group in self._channels.values():
+            for index, (_, seq, entry) in enumerate(group['heap']):
+                if entry['task_id'] == task_id:
+                    entry['priority'] = int(priority)
+                    group['heap'][index] = (self._sort_key(entry), seq, entry)
+                    heapq.heapify(group['heap'])
+                    return True
+        return False
+
+    def set_smallest_first(self, enabled: bool):
+        enabled = bool(enabled)
+        if enabled == self.smallest_first:
+            return
+        self.smallest_first = enabled
+        for group in self._channels.values():
+            group['heap'] = [(self._sort_key(e), seq, e) for _, seq, e in group['heap']]
+            heapq.heapify(group['heap'])
+
+    def _select_group(self):
+        candidates = []
+        best = None
+        for group in self._channels.values():
+            if not group['heap']:
+                continue
+            head = group['heap'][0][2]
+            effective = group['priority'] + head['priority']
+            if best is None or effective > best:
+                best = effective
+                candidates = [group]
+            elif effective == best:
+                candidates.append(group)
+
+        # 平滑加权轮转: 每轮各候选累加自身权重，选出当前值最大者并扣除总权重
+        total = 0
+        chosen = None
+        for group in candidates:
+            group['current'] += group['weight']
+            total += group['weight']
+            if chosen is None or group['current'] > chosen['current']:
+                chosen = group
+        chosen['current'] -= total
+        return chosen
+
+    def _wakeup_next(self):
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+import psutil
+
+from database import db_manager
+
+# 快照刷新间隔（秒）；超过 IDLE_TIMEOUT 秒没有人读取时后台线程退出，下次读取时重新启动
+REFRESH_INTERVAL = 1.0
+# 磁盘、内存、负载等系统信息的采样间隔（秒），两次采样之间快照内容不变，客户端可以得到 304
+SYSTEM_INTERVAL = 10
+IDLE_TIMEOUT = 60
+GB = 1024 ** 3
+
+
+def collect_downloads(db=db_manager) -> dict:
+    """活跃任务进度与 Bot 状态"""
+    from telegram_downloader import bot_active_status
+    from progress import progress_tracker
+    active_downloads = []
+    for t in db.get_active_tasks():
+        acc_id = t['account_id']
+        progress_data = progress_tracker.get(acc_id, t['id'])
+        active_downloads.append({
+            'id': t['id'],
+            'acc_id': str(acc_id),
+            'channel_name': t['channel_name'] or t['account_name'] or '未知频道',
+            'name': t['file_name'],
+            'status': t['status'],
+            'percentage': progress_data.get('percentage', 0),
+            'downloaded': progress_data.get('downloaded_mb', 0),
+            'total': progress_data.get('total_mb', 0),
+            'speed': progress_data.get('speed', '0 MB/s'),
+            'eta': progress_data.get('eta')
+        })
+    return {
+        'active_count': len(active_downloads),
+        'active_downloads': active_downloads,
+        'bot_status': dict(bot_active_status)
+    }
+
+
+def collect_system(db=db_manager) -> dict:
+    """磁盘、内存、负载与运行时间"""
+    download_dir = db.get_setting('DOWNLOAD_DIR', '/app/downloads')
+    if not os.path.exists(download_dir):
+        try: os.makedirs(download_dir, exist_ok=True)
+        except: download_dir = "."
+
+    download_total, download_used, download_free = shutil.disk_usage(download_dir)
+    total, used, free = shutil.disk_usage('/')
+    memory = psutil.virtual_memory()
+    try: load = list(psutil.getloadavg())
+    except AttributeError: load = [psutil.cpu_percent(), 0, 0]
+
+    return {
+        'uptime': int(time.time() - psutil.boot_time()),
+        'load': load,
+        'disk': {
+            'total': total // GB,
+            'used': used // GB,
+            'free': free // GB,
+            'percent': int((used / total) * 100) if total > 0 else 0,
+            'download_dir_total': download_total // GB,
+            'download_dir_free': download_free // GB
+        },
+        'memory': {
+            'total': round(memory.total / GB, 1),
+            'used': round(memory.used / GB, 1),
+            'percent': memory.percent
+        }
+    }
+
+
+class StatusSnapshot:
+    """
+    /api/status 的内存快照。
+    后台线程每 REFRESH_INTERVAL 秒生成一次状态（系统信息每 SYSTEM_INTERVAL 秒采样一次）并预先序列化为 JSON，
+    所有客户端的请求只读取同一份快照，查询数据库和系统资源的开销与打开的面板数量无关。
+    ETag 取自响应内容的哈希，内容未变化时客户端携带 If-None-Match 可得到 304。
+    """
+
+    def __init__(self, db=db_manager, interval: float = REFRESH_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._updated = threading.Condition()
+        self._thread = None
+        self._snapshot = None # (body, etag)
+        self.data = None
+        self.version = 0
+        self._system = None
+        self._system_at = 0
+        self._last_read = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._system is None or now - self._system_at >= SYSTEM_INTERVAL:
+            self._system = collect_system(self.db)
+            self._system_at = now
+        data = {**collect_downloads(self.db), **self._system}
+        body = json.dumps({'code': 200, 'data': data}, ensure_ascii=False, separators=(',', ':'))
+        etag = '"' + hashlib.sha1(body.encode()).hexdigest()[:16] + '"'
+        with self._updated:
+            self._snapshot = (body, etag)
+            self.data = data
+            self.version += 1
+            self._updated.notify_all()
+
+    def _run(self):
+        while time.monotonic() - self._last_read < IDLE_TIMEOUT:
+            time.sleep(self.interval)
+            try:
+                self._refresh()
+            except Exception as e:
+                # 保留上一份快照，下一轮重试
+                logging.error(f"刷新状态快照失败: {e}")
+        with self._lock:
+            self._thread = None
+
+    def get(self) -> tuple:
+        """返回 (JSON 文本, ETag)"""
+        self._last_read = time.monotonic()
+        with self._lock:
+            if self._thread is None:
+                # 首次读取或闲置后重新读取，快照可能已过期，先同步生成一次
+                self._refresh()
+                self._thread = threading.Thread(target=self._run, name='status-snapshot', daemon=True)
+                self._thread.start()
+        return self._snapshot
+
+    def wait(self, version: int, timeout: float) -> tuple:
+        """等待版本号超过 version 的快照（用于推送），超时返回当前快照；返回 (版本号, data)"""
+        self.get()
+        with self._updated:
+            self._updated.wait_for(lambda: self.version > version, timeout)
+            return self.version, self.data
+
+
+status_snapshot = StatusSnapshot()
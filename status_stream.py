@@ -0,0 +1,68 @@
+import json
+import time
+
+from status_snapshot import status_snapshot
+
+# 没有变化时发送注释行的间隔（秒），保持代理连接并及时发现已断开的客户端
+HEARTBEAT_INTERVAL = 15
+# 客户端断线后的重连间隔（毫秒）
+RETRY_MS = 3000
+SYSTEM_KEYS = ('uptime', 'load', 'disk', 'memory')
+
+
+def _event(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def diff_status(prev: dict, cur: dict) -> dict:
+    """
+    计算两份状态之间的增量，没有变化时返回空字典：
+    tasks: {任务 ID: 变化的字段}（新任务为全部字段），removed: 已结束的任务 ID，
+    order: 活跃任务顺序（有变化时），bot_status / system: 有变化时整体下发
+    """
+    delta = {}
+    prev_tasks = {t['id']: t for t in prev['active_downloads']}
+    changed = {}
+    for task in cur['active_downloads']:
+        old = prev_tasks.get(task['id'])
+        fields = {k: v for k, v in task.items() if old is None or old.get(k) != v}
+        if fields:
+            changed[task['id']] = fields
+    if changed:
+        delta['tasks'] = changed
+    order = [t['id'] for t in cur['active_downloads']]
+    if order != [t['id'] for t in prev['active_downloads']]:
+        delta['order'] = order
+        current = set(order)
+        removed = [task_id for task_id in prev_tasks if task_id not in current]
+        if removed:
+            delta['removed'] = removed
+    if cur['bot_status'] != prev['bot_status']:
+        delta['bot_status'] = cur['bot_status']
+    system = {k: cur[k] for k in SYSTEM_KEYS if cur[k] != prev[k]}
+    if system:
+        delta['system'] = system
+    return delta
+
+
+def status_events(snapshot=status_snapshot):
+    """
+    Server-Sent Events 生成器：连接建立时发送一次完整状态（snapshot 事件），
+    之后每次快照更新只发送与该客户端上次收到的状态之间的增量（delta 事件）。
+    所有客户端共享同一个快照生产者，连接数不增加数据库和系统调用开销。
+    """
+    yield f"retry: {RETRY_MS}\n\n"
+    version, data = snapshot.wait(0, 0)
+    yield _event('snapshot', data)
+    last_sent = time.monotonic()
+    while True:
+        version, cur = snapshot.wait(version, HEARTBEAT_INTERVAL)
+        delta = diff_status(data, cur) if cur is not data else {}
+        data = cur
+        if delta:
+            yield _event('delta', delta)
+        elif time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+            yield ": ping\n\n"
+        else:
+            continue
+        last_sent = time.monotonic()
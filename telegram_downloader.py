@@ -3,13 +3,22 @@ import logging
 from logging.handlers import RotatingFileHandler
 import time
 import asyncio
-import requests
 import re
 import shutil
-from urllib.parse import quote
 from telethon import TelegramClient, events
 from datetime import datetime
 from database import db_manager
+import download_engine
+from scheduler import download_slots, WorkerPool, FairQueue
+from progress import progress_status, progress_tracker, progress_ticker
+from message_bus import MessageBus
+from notifier import notifier
+from channel_resolver import channel_resolver
+from filename_registry import filename_registry
+from media_index import media_index, link_file
+from eviction import eviction_engine
+from disk_space import disk_space, release_unwritten
+import metrics
 
 # --- 辅助函数 ---
 def sanitize_filename(filename: str) -> str:
@@ -22,71 +31,29 @@ def sanitize_filename(filename: str) -> str:
         sanitized = name[:200] + ext
     return sanitized
 
-def send_push_notification_sync(content: str):
-    """从数据库获取所有启用的通知通道并发送"""
-    notifs = db_manager.get_notifications()
-    for n in notifs:
-        if not n['enabled']: continue
-        try:
-            if n['type'] == 'bark':
-                url = n['config'].get('barkUrl')
-                if not url: continue
-                full_url = f"{url.rstrip('/')}/{quote('TG-Downloader')}/{quote(content)}"
-                requests.get(full_url, timeout=10).raise_for_status()
-        except Exception as e:
-            logging.error(f"发送通知 [{n['name']}] 失败: {e}")
-
-async def send_push_notification(content: str):
-    await asyncio.to_thread(send_push_notification_sync, content)
+def send_push_notification(content: str):
+    """投递到常驻通知分发器，不阻塞调用方"""
+    notifier.notify(content)
 
 # 全局状态管理
 bot_active_status = {} # { account_id: "status_text" }
-# { account_id: { message_id: { percentage, ... } } }
-progress_status = {}
+# 下载进度见 progress.progress_status: { account_id: { task_id: { percentage, ... } } }
+# { account_id: WorkerPool }
+worker_pools = {}
+# { account_id: FairQueue }
+download_queues = {}
 
-async def progress_callback(client, account_id, message_id, current, total, file_name, channel_id):
-    now = time.time()
-    if account_id not in progress_status: progress_status[account_id] = {}
-    
-    if message_id not in progress_status[account_id]:
-        progress_status[account_id][message_id] = {
-            'last_update': 0, 
-            'start_time': now, 
-            'file_name': file_name,
-            'channel_id_raw': channel_id
-        }
-
-    elapsed = now - progress_status[account_id][message_id]['start_time']
-    downloaded_mb = current / 1024 / 1024
-    total_mb = total / 1024 / 1024
-    percentage = current * 100 / total if total > 0 else 0
-    speed = (current / elapsed) / 1024 / 1024 if elapsed > 0 else 0
-    
-    progress_status[account_id][message_id].update({
-        'percentage': round(percentage, 1),
-        'downloaded_mb': round(downloaded_mb, 2),
-        'total_mb': round(total_mb, 2),
-        'speed': f"{speed:.2f} MB/s"
-    })
-
-    if now - progress_status[account_id][message_id]['last_update'] < 2.5 and current != total:
-        return
+def _download_speeds() -> dict:
+    return {
+        (str(acc_id),): sum(entry.get('speed_bps', 0) for entry in list(tasks.values()))
+        for acc_id, tasks in list(progress_status.items())
+    }
 
-    progress_status[account_id][message_id]['last_update'] = now
-    try:
-        filled_blocks = int(round(percentage / 10))
-        progress_bar = '█' * filled_blocks + '░' * (10 - filled_blocks)
-        text = (
-            f"**正在下载**: `{file_name}`\n\n"
-            f"**进度**: `[{progress_bar}] {percentage:.1f}%`\n\n"
-            f"**大小**: `{downloaded_mb:.2f}MB / {total_mb:.2f}MB`"
-        )
-        await client.edit_message(channel_id, message_id, text)
-    except: pass
-    
-    if current == total:
-        if message_id in progress_status[account_id]:
-            del progress_status[account_id][message_id]
+metrics.Gauge('tg_queue_depth', '账号队列中等待的任务数',
+              lambda: {(str(acc_id),): q.qsize() for acc_id, q in list(download_queues.items())}, ('account',))
+metrics.Gauge('tg_workers_busy', '账号正在处理任务的 worker 数',
+              lambda: {(str(acc_id),): p.busy for acc_id, p in list(worker_pools.items())}, ('account',))
+metrics.Gauge('tg_download_speed_bytes', '账号当前的下载速度（字节/秒，平滑值）', _download_speeds, ('account',))
 
 async def process_video_message(client, message, account_config):
     account_id = account_config['id']
@@ -96,7 +63,15 @@ async def process_video_message(client, message, account_config):
     download_dir = db_manager.get_setting('DOWNLOAD_DIR', '/app/downloads')
     os.makedirs(download_dir, exist_ok=True)
     
-def get_file_name_and_path(message, account_id):
+def match_channel(message, account_id):
+    """根据消息来源匹配数据库中的频道记录（哈希索引查找，见 channel_resolver）"""
+    chat_username = None
+    try:
+        chat_username = getattr(message.chat, 'username', None)
+    except: pass
+    return channel_resolver.resolve(account_id, message.chat_id, chat_username)
+
+def get_file_name_and_path(message, account_id, target_channel=None):
     # 1. 获取原始文件名和后缀
     original_file_name = "default.mp4"
     if message.video.attributes:
@@ -128,58 +103,61 @@ def get_file_name_and_path(message, account_id):
     new_file_name = f"{sanitized_name}{file_ext}"
 
     # 3. 匹配频道和获取目录
-    target_channel = None
-    all_channels = db_manager.get_channels(account_id)
-    real_chat_id = message.chat_id
-    
-    chat_username = None
-    try:
-        if hasattr(message.chat, 'username'):
-            chat_username = message.chat.username
-    except: pass
-
-    for ch in all_channels:
-        stored_id = str(ch['channel_id']).strip()
-        id_match = (str(real_chat_id) == stored_id) or \
-                   (str(real_chat_id) == f"-100{stored_id}") or \
-                   (f"-100{real_chat_id}" == stored_id) or \
-                   (stored_id in str(real_chat_id))
-        username_match = False
-        if chat_username and stored_id.lower() == chat_username.lower():
-            username_match = True
-        link_match = False
-        if 't.me/' in stored_id:
-            db_uname = stored_id.split('/')[-1]
-            if chat_username and db_uname.lower() == chat_username.lower():
-                link_match = True
-
-        if id_match or username_match or link_match:
-            target_channel = ch
-            break
-            
-    download_dir = db_manager.get_setting('DOWNLOAD_DIR', '/app/downloads')
-    subdir = ""
-    db_channel_id = None
-    if target_channel:
-        db_channel_id = target_channel['id']
-        if target_channel.get('custom_path'):
-            subdir = target_channel['custom_path'].strip().strip('/\\')
-    
-    current_download_dir = os.path.join(download_dir, subdir) if subdir else download_dir
+    if target_channel is None:
+        target_channel = match_channel(message, account_id)
+    current_download_dir = get_channel_download_dir(target_channel)
+    db_channel_id = target_channel['id'] if target_channel else None
     os.makedirs(current_download_dir, exist_ok=True)
     
-    # 判重
-    counter = 1
-    root_name = sanitized_name
-    while os.path.exists(os.path.join(current_download_dir, new_file_name)):
-        new_file_name = f"{root_name}_{counter}{file_ext}"
-        counter += 1
+    # 判重：从占用表原子地分配文件名
+    new_file_name = filename_registry.reserve(current_download_dir, sanitized_name, file_ext)
     
     return new_file_name, os.path.join(current_download_dir, new_file_name), db_channel_id
 
-async def process_video_message(client, message, account_config, task_id=None):
+def get_channel_download_dir(target_channel) -> str:
+    download_dir = db_manager.get_setting('DOWNLOAD_DIR', '/app/downloads')
+    subdir = ""
+    if target_channel and target_channel.get('custom_path'):
+        subdir = target_channel['custom_path'].strip().strip('/\\')
+    return os.path.join(download_dir, subdir) if subdir else download_dir
+
+async def assign_file_name_and_path(message, account_id, target_channel=None):
+    """
+    在事件循环中分配保存路径：目录已建立文件名索引时只查内存，直接分配；
+    首次使用目录时需要读数据库和扫描目录，放到线程中执行
+    """
+    if target_channel is None:
+        target_channel = match_channel(message, account_id)
+    if filename_registry.indexed(get_channel_download_dir(target_channel)):
+        return get_file_name_and_path(message, account_id, target_channel)
+    return await asyncio.to_thread(get_file_name_and_path, message, account_id, target_channel)
+
+class PhaseTimer:
+    """按顺序累计任务各阶段的耗时（秒），随任务记录保存，用于定位慢下载的瓶颈"""
+
+    def __init__(self, timings: dict = None):
+        self.timings = {k: v for k, v in (timings or {}).items() if v is not None}
+        self.mark = time.monotonic()
+
+    def lap(self, phase: str, now: float = None):
+        """把上一个时刻到现在的耗时计入 phase"""
+        now = time.monotonic() if now is None else now
+        self.timings[phase] = round(self.timings.get(phase, 0) + max(0.0, now - self.mark), 3)
+        self.mark = now
+
+    def set(self, phase: str, seconds: float):
+        self.timings[phase] = round(seconds, 3)
+
+async def process_video_message(client, bus, message, account_config, task_id=None, timings=None, slot=None):
+    """
+    timings: 调用方已测得的阶段耗时（排队、等待槽位）
+    slot: 调用方持有的全局下载槽位（SlotLease），等待磁盘空间期间让出
+    """
     account_id = account_config['id']
     channel_id = message.chat_id if hasattr(message, 'chat_id') else message.source_channel_id
+    # 恢复任务沿用数据库中记录的保存路径，以便找到对应的 .part 续传
+    recovered = message if isinstance(message, RecoveredTask) else None
+    timer = PhaseTimer(timings)
     
     # 尝试从 Telegram 重新获取完整消息对象（兼容恢复任务）
     if not hasattr(message, 'media') or message.media is None:
@@ -190,132 +168,287 @@ async def process_video_message(client, message, account_config, task_id=None):
             if not real_msg or not real_msg.media:
                 raise Exception("无法从 Telegram 获取消息内容，可能已被删除")
             message = real_msg
+            timer.lap('fetch')
         except Exception as e:
             logging.error(f"恢复消息对象失败: {e}")
-            if task_id: db_manager.update_task_status(task_id, 'failed', error_msg=f"消息恢复失败: {e}")
+            if recovered: filename_registry.release(recovered.file_path)
+            if task_id: await asyncio.to_thread(db_manager.update_task_status, task_id, 'failed', error_msg=f"消息恢复失败: {e}")
             return
 
-    new_file_name, file_path, db_channel_id = get_file_name_and_path(message, account_id)
+    total_size = message.file.size if hasattr(message, 'file') and message.file else 0
+    # 入队时已为任务预定保存路径（恢复任务沿用数据库中的记录），下载时沿用该路径
+    if recovered:
+        planned_path, planned_channel_id = recovered.file_path, recovered.channel_db_id
+        resume_count = recovered.resume_count
+    elif task_id:
+        # 读取前需等待写线程提交（flush），放到线程中执行，不阻塞事件循环
+        task = await asyncio.to_thread(db_manager.get_task, task_id) or {}
+        planned_path, planned_channel_id = task.get('file_path'), task.get('channel_id')
+        resume_count = task.get('resume_count') or 0
+    else:
+        planned_path = planned_channel_id = None
+        resume_count = 0
+    if planned_path and _is_resumable_path(planned_path, total_size):
+        file_path = planned_path
+        new_file_name = os.path.basename(file_path)
+        db_channel_id = planned_channel_id
+    else:
+        filename_registry.release(planned_path)
+        new_file_name, file_path, db_channel_id = await assign_file_name_and_path(message, account_id)
     
     status_message = None
+    reservation = None
+    chunk_map = None
+    avg_speed = None
 
     try:
-        # 检查是否可以断点续传
-        offset = 0
-        if os.path.exists(file_path):
-            offset = os.path.getsize(file_path)
-            logging.info(f"📂 发现已存在文件，尝试从 {offset / 1024 / 1024:.2f}MB 处断点续传: {new_file_name}")
+        # 上次已完成下载但未来得及更新任务状态
+        if recovered and os.path.exists(file_path) and not os.path.exists(download_engine.part_path(file_path)):
+            logging.info(f"📂 文件已下载完成，直接标记任务完成: {new_file_name}")
+            end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            await asyncio.to_thread(db_manager.update_task_status, task_id, 'completed', end_time=end_time)
+            eviction_engine.track(task_id, file_path, end_time)
+            return
 
-        initial_text = f"**正在下载**\n\n**文件名**: `{new_file_name}`"
-        if offset > 0:
-            initial_text += f"\n**状态**: `断点续传中...`"
+        # 同一媒体已在磁盘上（多个频道转发同一视频）：按频道策略创建链接，跳过下载
+        channel = channel_resolver.get(account_id, db_channel_id) if db_channel_id else None
+        dedup = (channel or {}).get('dedup_policy') or 'link'
+        document = getattr(message, 'document', None)
+        linked_from = None
+        if dedup == 'link' and document is not None and total_size > 0:
+            source = await asyncio.to_thread(media_index.find, document.id, total_size)
+            if source and source['file_path'] != file_path \
+                    and await asyncio.to_thread(link_file, source['file_path'], file_path):
+                linked_from = source
+        timer.lap('prepare')
+
+        # 检查是否可以断点续传（按分块位图）
+        offset = 0
+        if total_size > 0 and not linked_from:
+            # 准入控制：按目标卷预留空间并预分配 .part，空间不足时任务保持等待而不是写到一半失败；
+            # 等待期间让出全局槽位，其他放得下的文件可以先下载
+            reservation = await disk_space.reserve(file_path, total_size, on_wait=eviction_engine.wake, wait=slot is None)
+            if reservation is None:
+                async with slot.suspend():
+                    reservation = await disk_space.reserve(file_path, total_size, on_wait=eviction_engine.wake)
+            timer.lap('reserve')
+            media_id = getattr(document, 'id', None) if document is not None else None
+            chunk_map = await download_engine.open_chunk_map(file_path, total_size, media_id or message.id)
+            timer.lap('verify')
+            offset = chunk_map.done_bytes
+            if offset > 0:
+                resume_count += 1
+                logging.info(f"📂 发现未完成的下载，已完成 {offset / 1024 / 1024:.2f}MB，续传缺失分块: {new_file_name}")
 
-        status_message = await client.send_message(channel_id, initial_text)
-        await send_push_notification(f"🚀 [{account_config['name']}] {'续传' if offset > 0 else '开始'}下载: {new_file_name}")
-        
         if task_id:
             db_manager.update_task_status(task_id, 'downloading', start_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            # 同时更新 message_id 为新的状态消息 ID
-            conn = db_manager._get_connection()
-            try:
-                with conn:
-                    conn.execute("UPDATE tasks SET message_id = ? WHERE id = ?", (status_message.id, task_id))
-            finally: conn.close()
+            if file_path != planned_path:
+                db_manager.update_task_file(task_id, new_file_name, file_path)
         else:
             task_id = db_manager.add_task({
                 'account_id': account_id,
                 'channel_id': db_channel_id,
-                'message_id': status_message.id,
                 'file_name': new_file_name,
                 'file_path': file_path, 
                 'file_size': 0,
                 'status': 'downloading',
                 'start_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'source_message_id': message.id,
-                'source_channel_id': channel_id
+                'source_channel_id': channel_id,
+                'caption': message.text
             })
+
+        timer.lap('db')
+
+        if linked_from:
+            logging.info(f"♻️ 已存在相同媒体，创建链接跳过下载: {new_file_name} -> {linked_from['file_path']}")
+            end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            await asyncio.to_thread(db_manager.update_task_status, task_id, 'completed', end_time=end_time)
+            eviction_engine.track(task_id, file_path, end_time)
+            await asyncio.to_thread(media_index.record, task_id, document, total_size, linked_from['content_hash'])
+            bus.send(
+                channel_id,
+                f"✅ **已存在相同文件，未重复下载**\n\n**文件名**: `{new_file_name}`\n**大小**: `{total_size / 1024 / 1024:.2f} MB`",
+                on_sent=lambda sent, tid=task_id: db_manager.update_task_message_id(tid, sent.id)
+            )
+            send_push_notification(f"♻️ [{account_config['name']}] 重复文件已链接: {new_file_name}")
+            metrics.DOWNLOADS.inc(1, str(account_id), 'linked')
+            timer.lap('finalize')
+            return
+
+        initial_text = f"**正在下载**\n\n**文件名**: `{new_file_name}`"
+        if offset > 0:
+            initial_text += f"\n**状态**: `断点续传中...`"
+
+        # 状态消息由消息总线异步发送，发送成功后再记录其 message_id
+        status_message = bus.send(
+            channel_id, initial_text,
+            on_sent=lambda sent, tid=task_id: db_manager.update_task_message_id(tid, sent.id)
+        )
+        send_push_notification(f"🚀 [{account_config['name']}] {'续传' if offset > 0 else '开始'}下载: {new_file_name}")
     
-        # 使用 iter_download 手动控制文件流以实现断点续传，提高版本兼容性
-        downloaded = offset
-        total_size = message.file.size if hasattr(message, 'file') and message.file else 0
-        
-        with open(file_path, 'ab') as f:
-            async for chunk in client.iter_download(
-                message.media,
-                offset=offset,
-                request_size=1024*1024 # 1MB 块大小
-            ):
-                f.write(chunk)
-                downloaded += len(chunk)
-                # 触发进度回调
-                await progress_callback(
-                    client, account_id, status_message.id, 
-                    downloaded, total_size or downloaded, 
-                    new_file_name, channel_id
-                )
+        connections = db_manager.get_int_setting('DOWNLOAD_CONNECTIONS', 4)
+        fsync_policy = db_manager.get_setting('DISK_FSYNC_POLICY', 'close')
+
+        progress_tracker.start(account_id, task_id, new_file_name, total_size, status_message, offset)
+        stats = {}
+        timer.lap('prepare')
+        download_start = timer.mark
+
+        channel_label = (channel or {}).get('channel_name') or str(channel_id)
+        downloaded = [offset]
+
+        async def on_progress(current):
+            progress_tracker.update(account_id, task_id, current)
+            if current > downloaded[0]:
+                metrics.DOWNLOAD_BYTES.inc(current - downloaded[0], str(account_id), channel_label)
+                downloaded[0] = current
+
+        if chunk_map:
+            # 按分块位图多路并发下载缺失区间，写入 .part 后原子重命名
+            await download_engine.download_file(
+                client, message.media, file_path, chunk_map,
+                connections=connections, progress=on_progress, fsync_policy=fsync_policy, stats=stats
+            )
+        else:
+            await download_engine.sequential_download(
+                client, message.media, file_path,
+                progress=on_progress, fsync_policy=fsync_policy, stats=stats
+            )
+        # 首字节时间 / 传输 / 关闭文件（写完队列、fsync、重命名）；写盘与传输并行，单独记录忙碌时间
+        first_byte = stats.get('first_byte', stats['received'])
+        timer.lap('ttfb', first_byte)
+        timer.lap('transfer', stats['received'])
+        timer.lap('flush', stats['closed'])
+        timer.set('disk_write', stats['disk_write'])
+        if stats['closed'] > download_start:
+            avg_speed = round((downloaded[0] - offset) / (stats['closed'] - download_start), 1)
         
         file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-        await client.edit_message(channel_id, status_message.id, f"✅ **下载完成**\n\n**文件名**: `{new_file_name}`\n**大小**: `{file_size_mb:.2f} MB`")
-        await send_push_notification(f"✅ [{account_config['name']}] 下载完成: {new_file_name}")
-        if task_id: db_manager.update_task_status(task_id, 'completed', end_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        # 先停止进度刷新，避免之后的进度编辑覆盖完成状态
+        progress_tracker.finish(account_id, task_id)
+        bus.edit(status_message, f"✅ **下载完成**\n\n**文件名**: `{new_file_name}`\n**大小**: `{file_size_mb:.2f} MB`")
+        send_push_notification(f"✅ [{account_config['name']}] 下载完成: {new_file_name}")
+        end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        await asyncio.to_thread(db_manager.update_task_status, task_id, 'completed', end_time=end_time)
+        eviction_engine.track(task_id, file_path, end_time)
+        metrics.DOWNLOADS.inc(1, str(account_id), 'completed')
 
-    except Exception as e:
-        logging.error(f"下载失败: {e}")
-        if status_message: 
+        if document is not None and total_size > 0:
+            # 指纹登记失败不影响已完成的下载
             try:
-                await client.edit_message(channel_id, status_message.id, f"❌ **下载失败**\n\n原因: `{e}`")
-            except: pass
-        if task_id: db_manager.update_task_status(task_id, 'failed', end_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), error_msg=str(e))
+                content_hash = chunk_map.fingerprint() if chunk_map else None
+                await asyncio.to_thread(media_index.record, task_id, document, total_size, content_hash)
+                if content_hash and dedup == 'link':
+                    await asyncio.to_thread(media_index.dedupe_content, task_id, file_path, total_size, content_hash)
+            except Exception as e:
+                logging.error(f"登记媒体指纹失败: {e}")
+        timer.lap('finalize')
 
-async def queue_worker(client, queue, account_config):
-    while True:
+    except Exception as e:
+        logging.error(f"下载失败: {e}")
+        # 保留已完成分块，重试任务时按位图续传；预分配但未写入的空间立即归还。
+        # 保留的 .part 由淘汰引擎按保留期和磁盘水位删除，删除任务或清空记录时也会删除（见 api/tasks）
         try:
-            # 简单的并发控制: 检查当前下载中的任务数
-            # 如果超过限制，则等待。这是一个全局限制，虽然每个Bot线程独立，但都查同一个DB。
-            setting_val = db_manager.get_setting('MAX_CONCURRENT_DOWNLOADS')
-            try:
-                max_concurrent = int(setting_val) if setting_val else 3
-            except (ValueError, TypeError):
-                max_concurrent = 3
-            
-            while db_manager.get_active_task_count() >= max_concurrent:
-                logging.debug(f"并发数已满 ({max_concurrent})，等待中...")
-                await asyncio.sleep(5)
+            await asyncio.to_thread(release_unwritten, file_path, chunk_map)
+        except Exception as trim_error:
+            logging.error(f"释放 .part 预分配空间失败: {trim_error}")
+        filename_registry.release(file_path)
+        if task_id: progress_tracker.finish(account_id, task_id)
+        bus.edit(status_message, f"❌ **下载失败**\n\n原因: `{e}`")
+        if task_id:
+            end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            await asyncio.to_thread(db_manager.update_task_status, task_id, 'failed', end_time=end_time, error_msg=str(e))
+            eviction_engine.track(task_id, file_path, end_time, partial=True)
+        metrics.DOWNLOADS.inc(1, str(account_id), 'failed')
+    finally:
+        disk_space.release(reservation)
+        if task_id:
+            progress_tracker.finish(account_id, task_id)
+            db_manager.update_task_timings(task_id, timer.timings, avg_speed, resume_count)
 
-            item = await queue.get()
-            if isinstance(item, tuple):
-                message, task_id = item
-            else:
-                message, task_id = item, None
-                
-            await process_video_message(client, message, account_config, task_id)
-            queue.task_done()
-        except Exception as e:
-            logging.error(f"Worker Error: {e}")
+def get_smallest_first() -> bool:
+    return db_manager.get_bool_setting('SMALLEST_FILE_FIRST', False)
+
+def bump_task_priority(account_id, task_id, priority) -> bool:
+    """从其他线程调整排队中任务的优先级（任务不在内存队列中时返回 False）"""
+    queue = download_queues.get(account_id)
+    if not queue or not queue.loop or queue.loop.is_closed():
+        return False
+    queue.loop.call_soon_threadsafe(queue.reprioritize, task_id, priority)
+    return True
+
+def requeue_task(task) -> bool:
+    """从其他线程把任务重新放入账号的内存队列（Bot 未运行时返回 False，启动后由 recover_tasks 恢复）"""
+    queue = download_queues.get(task['account_id'])
+    if not queue or not queue.loop or queue.loop.is_closed():
+        return False
+    queue.loop.call_soon_threadsafe(lambda: queue.put_nowait(
+        (RecoveredTask(task), task['id']),
+        channel=channel_resolver.get(task['account_id'], task['channel_id']),
+        priority=task.get('priority') or 0,
+        size=int(task.get('file_size') or 0),
+        task_id=task['id']
+    ))
+    return True
+
+def get_per_account_limit() -> int:
+    return db_manager.get_int_setting('MAX_DOWNLOADS_PER_ACCOUNT', 3, minimum=1)
+
+async def handle_queue_item(client, bus, account_config, item, queue_waits=None):
+    """worker 池处理单个队列项；queue_waits 为 {task_id: 排队秒数}，由队列出队回调填写"""
+    if isinstance(item, tuple):
+        message, task_id = item
+    else:
+        message, task_id = item, None
+    timings = {}
+    if queue_waits and task_id in queue_waits:
+        timings['queue'] = round(queue_waits.pop(task_id), 3)
+
+    # 全局并发控制: 所有账号线程共享同一组槽位，下载结束立即唤醒下一个等待者（按账号轮转）
+    started = time.monotonic()
+    async with download_slots.slot(account_config['id']) as slot:
+        slot_wait = time.monotonic() - started
+        metrics.SLOT_WAIT.observe(slot_wait, str(account_config['id']))
+        timings['slot'] = round(slot_wait, 3)
+        await process_video_message(client, bus, message, account_config, task_id, timings, slot)
+
+class RecoveredTask:
+    """从数据库恢复的任务，由 process_video_message 重新从 Telegram 拉取完整消息"""
+    def __init__(self, data):
+        self.id = data['source_message_id']
+        self.chat_id = data['source_channel_id']
+        self.source_message_id = data['source_message_id']
+        self.source_channel_id = data['source_channel_id']
+        self.db_task_id = data['id']
+        self.file_path = data.get('file_path')
+        self.channel_db_id = data.get('channel_id')
+        self.resume_count = data.get('resume_count') or 0
+        # 模拟 Message 属性
+        self.text = ""
+        self.video = None 
+
+def _is_resumable_path(file_path, total_size) -> bool:
+    """恢复任务的原路径可继续使用：存在 .part，或最终文件不存在，或最终文件即为已完成的同一文件"""
+    if os.path.exists(download_engine.part_path(file_path)) or not os.path.exists(file_path):
+        return True
+    return total_size > 0 and os.path.getsize(file_path) == total_size
 
 async def recover_tasks(client, queue, account_id):
     """从数据库恢复未完成的任务"""
-    unfinished = db_manager.get_unfinished_tasks_by_account(account_id)
+    unfinished = await asyncio.to_thread(db_manager.get_unfinished_tasks_by_account, account_id)
     if not unfinished: return
     
     logging.info(f"🔍 发现 {len(unfinished)} 个未完成任务，正在尝试恢复队列...")
     for t in unfinished:
         try:
-            # 将字典转为类对象或直接在 worker 里处理
-            # 这里简单起见，我们构造一个虚假消息对象，或者让 process_video_message 自己去 fetch
-            # 我们给 queue 传递一个特殊的标记对象
-            class RecoveredTask:
-                def __init__(self, data):
-                    self.id = data['source_message_id']
-                    self.chat_id = data['source_channel_id']
-                    self.source_message_id = data['source_message_id']
-                    self.source_channel_id = data['source_channel_id']
-                    self.db_task_id = data['id']
-                    # 模拟 Message 属性
-                    self.text = ""
-                    self.video = None 
-            
-            await queue.put((RecoveredTask(t), t['id']))
+            await queue.put(
+                (RecoveredTask(t), t['id']),
+                channel=channel_resolver.get(account_id, t['channel_id']),
+                priority=t.get('priority') or 0,
+                size=int(t.get('file_size') or 0),
+                task_id=t['id']
+            )
         except Exception as e:
             logging.error(f"恢复任务 {t['id']} 失败: {e}")
 
@@ -358,7 +491,18 @@ async def run_account_bot(account_config, stop_event):
 
     logging.info(f"Bot [{account_name}] 正在尝试连接 Telegram (API_ID: {account_config['api_id']})...")
     client = TelegramClient(session_file, account_config['api_id'], account_config['api_hash'])
-    queue = asyncio.Queue()
+    bus = MessageBus(client, name=account_name)
+    # 出队时记录排队时长，worker 开始处理时取走并随任务保存
+    queue_waits = {}
+
+    def on_dequeue(waited, task_id):
+        metrics.QUEUE_WAIT.observe(waited, str(account_id))
+        if task_id is not None:
+            queue_waits[task_id] = waited
+
+    queue = FairQueue(smallest_first=get_smallest_first(), on_dequeue=on_dequeue)
+    ticker = None
+    pool = WorkerPool(queue, lambda item: handle_queue_item(client, bus, account_config, item, queue_waits), name=account_name)
     
     try:
         @client.on(events.NewMessage(chats=channel_list))
@@ -366,19 +510,23 @@ async def run_account_bot(account_config, stop_event):
             if event.message.video and not event.message.is_reply:
                 # 1. 快速回复并创建等待任务
                 try:
-                    fn, fp, cid = get_file_name_and_path(event.message, account_id)
+                    channel = match_channel(event.message, account_id)
+                    fn, fp, cid = await assign_file_name_and_path(event.message, account_id, channel)
+                    size = event.message.file.size if event.message.file else 0
                     task_id = db_manager.add_task({
                         'account_id': account_id,
                         'channel_id': cid,
                         'file_name': fn,
                         'file_path': fp,
+                        'file_size': size,
                         'status': 'waiting',
                         'start_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                         'source_message_id': event.message.id,
-                        'source_channel_id': event.message.chat_id
+                        'source_channel_id': event.message.chat_id,
+                        'caption': event.message.text
                     })
-                    await event.reply("✅ **已加入队列**，等待排队下载...")
-                    await queue.put((event.message, task_id))
+                    bus.reply(event.message, "✅ **已加入队列**，等待排队下载...")
+                    await queue.put((event.message, task_id), channel=channel, size=size, task_id=task_id)
                 except Exception as e:
                     logging.error(f"加入队列失败: {e}")
                     await queue.put(event.message)
@@ -403,17 +551,21 @@ async def run_account_bot(account_config, stop_event):
                 raise e
         
         bot_active_status[account_id] = "running"
-        asyncio.create_task(queue_worker(client, queue, account_config))
+        bus.start()
+        ticker = asyncio.create_task(progress_ticker(bus, account_id))
+        pool.start(get_per_account_limit())
+        worker_pools[account_id] = pool
+        download_queues[account_id] = queue
         # 启动时恢复历史任务
         await recover_tasks(client, queue, account_id)
         
         # 记录已连接
         # 记录已连接
         logging.info(f"Bot [{account_name}] 启动成功，正在监听 {len(channel_list)} 个频道")
-        await send_push_notification(f"🤖 机器人上线: {account_name}\n监听频道: {len(channel_list)} 个")
+        send_push_notification(f"🤖 机器人上线: {account_name}\n监听频道: {len(channel_list)} 个")
         
         # 发送频道上线通知 (根据设置)
-        if db_manager.get_setting('SEND_CHANNEL_LOGIN_MSG', False):
+        if db_manager.get_bool_setting('SEND_CHANNEL_LOGIN_MSG', False):
             logging.info(f"Bot [{account_name}] 正在向频道发送上线通知...")
             
             # 获取当前版本号
@@ -425,10 +577,7 @@ async def run_account_bot(account_config, stop_event):
                 pass
 
             for cid in channel_list:
-                try:
-                    await client.send_message(cid, f"🤖 **机器人已上线**\n\n**账号**: `{account_name}`\n**版本**: `{version_str}`\n**时间**: `{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}`")
-                except Exception as e:
-                    logging.error(f"向频道 [{cid}] 发送上线消息失败: {e}")
+                bus.send(cid, f"🤖 **机器人已上线**\n\n**账号**: `{account_name}`\n**版本**: `{version_str}`\n**时间**: `{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}`")
         
         # 保持运行
         await asyncio.wait(
@@ -443,6 +592,15 @@ async def run_account_bot(account_config, stop_event):
         bot_active_status[account_id] = f"error: {str(e)}"
     finally:
         bot_active_status[account_id] = "stopped"
+        if worker_pools.get(account_id) is pool:
+            del worker_pools[account_id]
+        if download_queues.get(account_id) is queue:
+            del download_queues[account_id]
+        await pool.stop()
+        if ticker:
+            ticker.cancel()
+        # 断开前尽量发完排队中的状态消息
+        await bus.close(timeout=5.0 if client.is_connected() else 0)
         if client.is_connected():
             await client.disconnect()
         logging.info(f"Bot [{account_name}] 实例已彻底停止")
@@ -5,6 +5,7 @@ import threading
 from logging.handlers import TimedRotatingFileHandler
 
 from database import db_manager
+from eviction import eviction_engine
 from version import VERSION
 from api.common import login_required
 from bot_manager import start_account_bot, stop_all_bots
@@ -48,30 +49,11 @@ def index():
     return render_template('index.html')
 
 def cleanup_job():
-    """后台清理任务：清理过期文件和日志"""
+    """后台清理任务：清理过期日志（下载文件由 eviction.eviction_engine 按保留期和磁盘水位淘汰）"""
     import time
-    import datetime
-    import shutil
     while True:
         try:
-            # 1. 清理过期下载文件
-            retention_val = db_manager.get_setting('FILE_RETENTION_DAYS', '3')
-            try: retention_days = int(retention_val)
-            except: retention_days = 3
-                
-            if retention_days > 0:
-                cutoff_date = datetime.datetime.now() - datetime.timedelta(days=retention_days)
-                cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
-                expired_tasks = db_manager.get_expired_tasks(cutoff_str)
-                for task in expired_tasks:
-                    file_path = task['file_path']
-                    if file_path and os.path.exists(file_path):
-                        try: os.remove(file_path)
-                        except: pass
-                    if task['status'] != 'file_expired':
-                        db_manager.update_task_status(task['id'], 'file_expired', error_msg='File cleaned up by retention policy')
-            
-            # 2. 清理过期日志 (保留3天)
+            # 清理过期日志 (保留3天)
             now = time.time()
             for f in os.listdir(LOG_DIR):
                 f_path = os.path.join(LOG_DIR, f)
@@ -93,6 +75,7 @@ if __name__ == '__main__':
         db_manager.add_user('admin', hash_password('admin123'))
 
     # 启动后台清理
+    eviction_engine.start()
     threading.Thread(target=cleanup_job, daemon=True).start()
 
     # 启动所有账号 Bot
@@ -102,4 +85,8 @@ if __name__ == '__main__':
         if any(c['enabled'] == 1 for c in chs):
             start_account_bot(acc['id'])
 
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    try:
+        app.run(host='0.0.0.0', port=5001, debug=False)
+    finally:
+        eviction_engine.stop()
+        db_manager.close()